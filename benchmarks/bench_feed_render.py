@@ -0,0 +1,70 @@
+"""Compare rendering a global feed from the shared items with putting it
+together from the entries kept serialized by `SharedItems`.
+
+The items are loaded from a committed database each time, as they are
+when the feed isn't in the connection cache. Run it as:
+
+    python benchmarks/bench_feed_render.py [item count]
+"""
+
+import sys
+import timeit
+from datetime import datetime
+
+import transaction
+from dateutil.tz import tzutc
+from ZODB import DB
+
+from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
+from pushhubsearch.views import stream_feed
+
+
+def make_item(i):
+    return SharedItem(
+        Title=u'Item %s' % i,
+        portal_type=u'Document',
+        Creator=u'Jane',
+        Modified=datetime(2013, 1, 1, 0, i % 60, tzinfo=tzutc()),
+        url=u'http://example.com/item-%s' % i,
+        Description=u'Description of item %s' % i,
+        Subject=[u'one', u'two'],
+        Category=u'Example Site',
+        feed_type=['shared'],
+        tile_urls=[u'http://example.com/tile-%s' % (i % 10)],
+        content=[{'type': u'text/html', 'value': u'<p>Some body text</p>' * 40}],
+    )
+
+
+def render(conn, entries):
+    shared = conn.root()['shared']
+    conn.cacheMinimize()
+    first = next(shared.feed_items('shared', 0, 1))
+    return b''.join(stream_feed(
+        entries(shared), u'All Shared Entries', u'http://example.com',
+        u'A feed', updated=first.Modified))
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000]
+    for size in sizes:
+        db = DB(None)
+        conn = db.open()
+        conn.root()['shared'] = shared = SharedItems()
+        for i in range(size):
+            shared['item-%s' % i] = make_item(i)
+        transaction.commit()
+        number = max(1, 1000 // size)
+        for name, entries in (
+                ('items', lambda s: s.feed_items('shared')),
+                ('fragments', lambda s: s.feed_fragments('shared'))):
+            seconds = min(timeit.repeat(
+                lambda: render(conn, entries), number=number, repeat=3))
+            print('%5s items %-10s %9.2f ms per feed' % (
+                size, name, seconds / number * 1000))
+        conn.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Compare the size of a shared item stored with lists, feed names and
+its content (before `evolve`) and in its compact form, with the
+content in an `ItemBody`.
+
+Reports the size of the ZODB records and the memory taken by the
+unpickled item states, i.e. what the connection cache holds when the
+items are loaded without their content (this needs Python 3 for
+tracemalloc). Run it as:
+
+    python benchmarks/bench_item_size.py [item count]
+"""
+
+import pickle
+import sys
+import tracemalloc
+from datetime import datetime
+
+import transaction
+from dateutil.tz import tzutc
+from mock import patch
+from ZODB import DB
+
+from pushhubsearch.models import CONTENT_KEYS
+from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
+
+
+def make_item(i):
+    return SharedItem(
+        Title=u'Item %s' % i,
+        portal_type=u'Document',
+        Creator=u'Jane',
+        Modified=datetime(2013, 1, 1, tzinfo=tzutc()),
+        url=u'http://example.com/item-%s' % i,
+        Description=u'Description of item %s' % i,
+        Subject=[u'one', u'two'],
+        Category=u'Example Site',
+        feed_type=['shared', 'selected'],
+        tile_urls=[u'http://example.com/tile-%s' % (i % 10)],
+        content=[{'type': u'text/html', 'language': u'en',
+                  'base': u'http://example.com',
+                  'value': u''.join(u'<p>Paragraph %s of item %s</p>' % (p, i)
+                                    for p in range(40))}],
+    )
+
+
+def legacy_state(item):
+    """The state the item had before it was made compact"""
+    state = dict(item.__dict__)
+    state['feed_type'] = list(item.feed_type)
+    state['content'] = [
+        dict(zip(CONTENT_KEYS, c)) for c in item._body.content]
+    del state['_feeds']
+    del state['_body']
+    for name in SharedItem.tuple_attributes:
+        state[name] = list(state[name])
+    return state
+
+
+def record_sizes(size, legacy):
+    db = DB(None)
+    conn = db.open()
+    conn.root()['shared'] = shared = SharedItems()
+    items = [make_item(i) for i in range(size)]
+    if legacy:
+        with patch.object(SharedItem, '__getstate__', legacy_state):
+            for i, item in enumerate(items):
+                shared['item-%s' % i] = item
+            transaction.commit()
+    else:
+        for i, item in enumerate(items):
+            shared['item-%s' % i] = item
+        transaction.commit()
+    total = sum(len(db.storage.load(item._p_oid, '')[0]) for item in items)
+    bodies = 0
+    if not legacy:
+        bodies = sum(len(db.storage.load(item._body._p_oid, '')[0])
+                     for item in items)
+    conn.close()
+    db.close()
+    return total, bodies
+
+
+def state_memory(size, legacy):
+    """Memory of the unpickled states of `size` items"""
+    states = []
+    for i in range(size):
+        item = make_item(i)
+        state = legacy_state(item) if legacy else dict(item.__dict__)
+        state.pop('__parent__', None)
+        state.pop('_body', None)
+        states.append(pickle.dumps(state, 1))
+    tracemalloc.start()
+    loaded = [pickle.loads(state) for state in states]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+    return memory
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000]
+    for size in sizes:
+        for legacy, name in ((True, 'lists'), (False, 'compact')):
+            records, bodies = record_sizes(size, legacy)
+            memory = state_memory(size, legacy)
+            print('%6s items %-8s %7.1f bytes per item record '
+                  '%7.1f per body record %7.1f bytes in memory' % (
+                      size, name, records / float(size),
+                      bodies / float(size), memory / float(size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Compare feedparser with the iterparse parser on a pushed feed.
+
+Run it as:
+
+    python benchmarks/bench_parser.py [entry count]
+"""
+
+import sys
+import timeit
+
+from pushhubsearch.parser import feedparser_entries
+from pushhubsearch.parser import iterparse_entries
+
+FEED = u"""\
+<?xml version="1.0" encoding="utf-8" ?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:push="http://ucla.edu/#portal-pool"
+      xml:base="http://example.com"
+      xml:lang="en">
+  <link rel="hub" href="http://example.com/hub" />
+  <link rel="self" href="http://example.com/shared-content.xml" />
+  <title type="html">Example Site</title>
+  <link rel="alternate" type="text/html"
+        href="http://example.com/shared-content.xml" />
+  <id>urn:syndication:site</id>
+%s
+</feed>"""
+ENTRY = u"""\
+  <entry>
+    <title>Item %(i)s</title>
+    <link rel="alternate" type="text/html"
+          href="http://example.com/item-%(i)s" />
+    <id>urn:syndication:item-%(i)s</id>
+    <updated>2013-01-01T00:00:00Z</updated>
+    <summary>Summary of item %(i)s</summary>
+    <content type="html">%(body)s</content>
+    <author><name>Jane</name></author>
+    <category term="Example Site" label="Site Title" />
+    <category term="news" />
+    <push:portal_type>Document</push:portal_type>
+    <push:tile_urls>http://example.com/tile-%(i)s</push:tile_urls>
+  </entry>"""
+
+
+def make_feed(size):
+    body = u'&lt;p&gt;Some body text&lt;/p&gt;' * 50
+    entries = u''.join(ENTRY % {'i': i, 'body': body} for i in range(size))
+    return (FEED % entries).encode('utf-8')
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000]
+    for size in sizes:
+        body = make_feed(size)
+        number = max(1, 1000 // size)
+        for name, parse in (('feedparser', feedparser_entries),
+                            ('iterparse', iterparse_entries)):
+            seconds = min(timeit.repeat(
+                lambda: list(parse(body)), number=number, repeat=3))
+            print('%5s entries %-10s %9.2f ms per feed' % (
+                size, name, seconds / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
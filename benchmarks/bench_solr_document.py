@@ -0,0 +1,107 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+"""Compare the cost of building a Solr document for one shared item.
+
+The old way deep-copied `item.__dict__`, which includes `__parent__`
+and so drags the whole `SharedItems` folder along. Run it as:
+
+    python benchmarks/bench_solr_document.py [pool size]
+"""
+
+import copy
+import sys
+import timeit
+from datetime import datetime
+
+from dateutil.tz import tzutc
+
+from pushhubsearch.indexing import solr_document
+from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
+
+
+def deepcopy_document(item):
+    """How `UpdateItems._update_index` used to build documents"""
+    # Items used to keep their content in their own state
+    item_dict = copy.deepcopy(dict(item.__dict__, content=item.content))
+    mod_date = item_dict['Modified'].isoformat()
+    item_dict['Modified'] = "%sZ" % mod_date[:-6]
+    items = [i['value'] for i in item_dict['content']]
+    if items:
+        item_dict['content'] = items[0]
+    item_dict['uid'] = item_dict['__name__']
+    for attr in ('__name__', '__parent__', 'deletion_type', 'sequence'):
+        item_dict.pop(attr, '')
+    return item_dict
+
+
+def make_pool(size):
+    shared = SharedItems()
+    for i in range(size):
+        item = SharedItem(
+            Title='Item %s' % i,
+            Modified=datetime(2013, 1, 1, tzinfo=tzutc()),
+            url='http://example.com/item-%s' % i,
+            Description='Description of item %s' % i,
+            Subject=['one', 'two'],
+            Category='Example Site',
+            feed_type=['shared', 'selected'],
+            tile_urls=['http://example.com/tile-%s' % i],
+            content=[{'type': 'text/html', 'value': '<p>%s</p>' % i * 50}],
+        )
+        shared['item-%s' % i] = item
+    return shared
+
+
+def bench(function, item, number):
+    best = min(timeit.repeat(
+        lambda: function(item), number=number, repeat=3))
+    return best / number * 1e6
+
+
+def main(argv=sys.argv):
+    size = int(argv[1]) if len(argv) > 1 else 1000
+    shared = make_pool(size)
+    item = shared['item-0']
+    number = max(1, 10000 // size)
+    print('pool of %s items' % size)
+    try:
+        print('deepcopy:      %10.1f us/item' % bench(
+            deepcopy_document, item, number))
+    except RuntimeError:
+        # The folder is too deep to copy without hitting the
+        # recursion limit
+        print('deepcopy:      fails, maximum recursion depth exceeded')
+    print('solr_document: %10.1f us/item' % bench(
+        solr_document, item, 10000))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,12 +29,19 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 from pyramid_zodbconn import get_connection
+from .indexing import schema_cache
+from .indexing import start_index_worker
 from .models import appmaker
+from .snapshot import start_snapshot_writer
 from .views import UpdateItems
 from .views import delete_items
 from .views import update_deletions
 from .views import global_shared, global_selected, global_deleted
+from .views import changes_feed
+from .views import tile_feed
+from .views import search
 
 
 def root_factory(request):
@@ -47,6 +54,11 @@ def main(global_config, **settings):
     """
     config = Configurator(root_factory=root_factory, settings=settings)
 
+    schema_cache.ttl = int(settings.get('push.solr_schema_ttl', 3600))
+
+    if asbool(settings.get('push.solr_async', False)):
+        start_index_worker(config.registry)
+
     config.add_static_view('static', 'static', cache_max_age=3600)
 
     config.add_route('update', '/update')
@@ -67,4 +79,20 @@ def main(global_config, **settings):
     config.add_route('deleted', 'global-deletions.xml')
     config.add_view(global_deleted, route_name='deleted')
 
-    return config.make_wsgi_app()
+    config.add_route('changes', '/changes.xml')
+    config.add_view(changes_feed, route_name='changes')
+
+    config.add_route('tile', '/tile.xml')
+    config.add_view(tile_feed, route_name='tile')
+
+    config.add_route('search', '/search')
+    config.add_view(search, route_name='search')
+
+    app = config.make_wsgi_app()
+
+    # The snapshots need the routes, which are only there once the
+    # configuration is committed
+    if settings.get('push.snapshot_dir'):
+        start_snapshot_writer(config.registry)
+
+    return app
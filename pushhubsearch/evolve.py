@@ -0,0 +1,112 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Bring the shared items of an existing database up to date.
+#
+# Items pickled before their feeds were stored as a bitmask and their
+# lists as tuples are converted by `SharedItem.__setstate__` whenever
+# they are loaded, but only stored in the compact form once they
+# change. Their content is only moved to an `ItemBody` when it
+# changes. Run this once to rewrite all of them:
+#
+#     pushhubsearch_evolve production.ini
+#
+# The same script builds the indexes of the folder when they are
+# missing or out of date, see `SharedItems.needs_reindex`.
+
+import sys
+from itertools import islice
+
+import transaction
+from pyramid.paster import bootstrap
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def evolve_items(shared, batch_size=1000):
+    """Store every item of the folder again, committing every
+    `batch_size` items. Returns the number of items.
+    """
+    count = 0
+    for count, item in enumerate(shared.values(), 1):
+        # Loading the item converts its state, then mark it to be
+        # stored again
+        item._p_activate()
+        item._p_changed = True
+        # Move the content into its own record
+        item.content = item.content
+        if count % batch_size == 0:
+            transaction.commit()
+            shared._p_jar.cacheGC()
+            logger.info('Evolved %s items' % count)
+    transaction.commit()
+    return count
+
+
+def reindex_items(shared, batch_size=1000):
+    """Build the indexes of the folder from scratch, committing every
+    `batch_size` items. Returns the number of items.
+    """
+    shared.clear_indexes()
+    transaction.commit()
+    count = 0
+    uids = list(islice(shared.data.keys(), batch_size))
+    while uids:
+        for uid in uids:
+            shared.index_item(uid, shared.data[uid])
+        count += len(uids)
+        transaction.commit()
+        shared._p_jar.cacheGC()
+        logger.info('Reindexed %s items' % count)
+        # Look the next batch up again, the folder may have changed
+        # since the last commit
+        uids = list(islice(
+            shared.data.keys(min=uids[-1], excludemin=True), batch_size))
+    shared.indexes_built()
+    transaction.commit()
+    return count
+
+
+def main(argv=sys.argv):
+    if len(argv) != 2:
+        sys.stderr.write('usage: %s config_uri\n' % argv[0])
+        return 1
+    env = bootstrap(argv[1])
+    try:
+        shared = env['root'].shared
+        count = evolve_items(shared)
+        sys.stdout.write('Evolved %s items\n' % count)
+        if shared.needs_reindex():
+            count = reindex_items(shared)
+            sys.stdout.write('Reindexed %s items\n' % count)
+    finally:
+        env['closer']()
+    return 0
@@ -28,13 +28,161 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+from itertools import chain
+from xml.sax.saxutils import XMLGenerator
+
 from pushhub.utils import Atom1FeedKwargs
 
+TOMBSTONES_NS = 'http://purl.org/atompub/tombstones/1.0'
+
+
+class SimplerXMLGenerator(XMLGenerator):
+
+    def addQuickElement(self, name, contents=None, attrs=None):
+        "Convenience method for adding an element with no children"
+        if attrs is None:
+            attrs = {}
+        self.startElement(name, attrs)
+        if contents is not None:
+            self.characters(contents)
+        self.endElement(name)
+
+
+class ChunkBuffer(object):
+    """A file-like sink that hands back what was written since the
+    last time it was emptied.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
 
 class Atom1Feed(Atom1FeedKwargs):
-    """Extend the atom1 generator"""
+    """Extend the atom1 generator
+
+    Pass `paging_links`, a list of `(rel, href)` tuples, to add the
+    RFC 5005 paging links (first, previous, next, last) to the feed,
+    and `sequence` to tell the reader up to which change sequence
+    number the feed goes.
+    """
 
     def root_attributes(self):
         attrs = super(Atom1Feed, self).root_attributes()
         attrs['xmlns:push'] = 'http://ucla.edu/#portal-pool'
         return attrs
+
+    def latest_post_date(self):
+        # A streamed feed has no items to look at, so it is told
+        updated = self.feed.get('updated')
+        if updated is not None:
+            return updated
+        return super(Atom1Feed, self).latest_post_date()
+
+    def stream(self, items, encoding='utf-8', tombstones=None):
+        """Serialize the feed, yielding the encoded XML an entry at a
+        time instead of building the whole document.
+
+        `items` is an iterable of `(args, kwargs)` tuples for
+        `add_item`, in the order they should appear. The first one is
+        used as the updated date of the feed. An item can also be an
+        entry already serialized by `entry_fragment`, which is written
+        out as is; pass `updated` to the feed when the first one is.
+        `tombstones` is an optional iterable of `(unique_id,
+        deletion_date)` tuples, written as RFC 6721 deleted entries
+        after the items.
+        """
+        items = iter(items)
+        first = next(items, None)
+        if first is not None:
+            if self.feed.get('updated') is None and \
+                    not isinstance(first, bytes):
+                self.feed['updated'] = first[1].get('pubdate')
+            items = chain([first], items)
+        out = ChunkBuffer()
+        handler = SimplerXMLGenerator(out, encoding)
+        attrs = self.root_attributes()
+        if tombstones is not None:
+            attrs['xmlns:at'] = TOMBSTONES_NS
+        handler.startDocument()
+        handler.startElement(u'feed', attrs)
+        self.add_root_elements(handler)
+        yield out.pop()
+        for item in items:
+            if isinstance(item, bytes):
+                yield item
+                continue
+            args, kwargs = item
+            self.write_entry(handler, args, kwargs)
+            yield out.pop()
+        for unique_id, when in tombstones or ():
+            attrs = {u'ref': unique_id}
+            if when is not None:
+                attrs[u'when'] = when.isoformat()
+            handler.addQuickElement(u'at:deleted-entry', None, attrs)
+            yield out.pop()
+        handler.endElement(u'feed')
+        handler.endDocument()
+        yield out.pop()
+
+    def write_entry(self, handler, args, kwargs):
+        """Write a single entry, given the `add_item` arguments"""
+        # Let add_item normalize the item, without keeping it
+        self.add_item(*args, **kwargs)
+        item = self.items.pop()
+        handler.startElement(u'entry', self.item_attributes(item))
+        self.add_item_elements(handler, item)
+        handler.endElement(u'entry')
+
+    def add_root_elements(self, handler):
+        super(Atom1Feed, self).add_root_elements(handler)
+        for rel, href in self.feed.get('paging_links') or ():
+            handler.addQuickElement(u'link', u'', {u'rel': rel, u'href': href})
+        sequence = self.feed.get('sequence')
+        if sequence is not None:
+            handler.addQuickElement(u'push:sequence', u'%s' % sequence)
+
+
+def feed_item(entry):
+    """The `Atom1Feed.add_item` arguments for a shared item"""
+    data = dict(
+        pubdate=entry.Modified,
+        unique_id='urn:syndication:%s' % entry.__name__,
+        categories=entry.Subject,
+        category={'term': entry.Category, 'label': u'Site Title'},
+        author_name=entry.Creator,
+    )
+    data['push:portal_type'] = entry.portal_type
+    # Tile urls are added into one element for now
+    data['push:tile_urls'] = '|'.join(entry.tile_urls).lstrip('|')
+    data['push:deleted_tile_urls'] = '|'.join(
+        entry.deleted_tile_urls).lstrip('|')
+    if getattr(entry, 'content', None):
+        data['content'] = entry.content
+    if hasattr(entry, 'deletion_type'):
+        data['push:deletion_type'] = entry.deletion_type
+    return (entry.Title, entry.url, entry.Description), data
+
+
+def entry_fragment(entry, encoding='utf-8'):
+    """The `<entry>` element of a shared item, serialized the same way
+    `Atom1Feed.stream` writes it.
+
+    The encoding has to match the one of the feed it goes into.
+    """
+    out = ChunkBuffer()
+    handler = SimplerXMLGenerator(out, encoding)
+    feed = Atom1Feed(title=u'', link=u'', description=u'')
+    args, kwargs = feed_item(entry)
+    feed.write_entry(handler, args, kwargs)
+    return out.pop()
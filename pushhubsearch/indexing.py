@@ -0,0 +1,523 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import threading
+import time
+from xml.sax.saxutils import escape
+
+import dateutil.parser
+import requests
+import transaction
+from dateutil.tz import tzutc
+from pyramid.path import DottedNameResolver
+from requests.adapters import HTTPAdapter
+from ZODB.POSException import ConflictError
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of uids removed from Solr per delete query
+DELETE_BATCH_SIZE = 100
+
+
+class SolrError(IOError):
+    """Solr answered a request with an error status"""
+
+
+def check_response(response, action):
+    """Raise a `SolrError` if Solr turned the request down. mysolr
+    returns the error responses instead of raising.
+    """
+    status = getattr(response, 'status', 200)
+    if status != 200:
+        raise SolrError('Solr %s failed with status %s' % (action, status))
+    return response
+
+
+class SolrSession(requests.Session):
+    """A requests session that keeps a pool of connections to Solr,
+    retries failed connections and doesn't wait forever.
+    """
+
+    def __init__(self, pool_size=10, timeout=10, retries=3):
+        super(SolrSession, self).__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retries,
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(SolrSession, self).request(method, url, **kwargs)
+
+
+def make_solr(settings):
+    """Create the Solr client of the application from its settings.
+
+    `push.solr_factory` can name another callable to create it from
+    the settings, e.g. a stand-in for the tests.
+    """
+    factory = settings.get('push.solr_factory')
+    if factory:
+        return DottedNameResolver().maybe_resolve(factory)(settings)
+    solr_uri = settings.get('push.solr_uri', None)
+    if solr_uri is None:
+        raise AttributeError(u'A push.solr_uri is required')
+    session = SolrSession(
+        pool_size=int(settings.get('push.solr_pool_size', 10)),
+        timeout=float(settings.get('push.solr_timeout', 10)),
+        retries=int(settings.get('push.solr_retries', 3)),
+    )
+    kwargs = {'make_request': session}
+    # Without a version mysolr asks Solr for it right away
+    version = settings.get('push.solr_version')
+    if version:
+        kwargs['version'] = int(version)
+    # XXX: We are importing solr here to be able to mock it in the tests
+    from mysolr import Solr
+    return Solr(solr_uri, **kwargs)
+
+
+_solr_lock = threading.Lock()
+
+
+def get_solr(registry):
+    """The Solr client shared by all requests and the indexing
+    worker, created on first use so that the application starts even
+    when Solr is down.
+    """
+    solr = getattr(registry, 'solr', None)
+    if solr is None:
+        with _solr_lock:
+            solr = getattr(registry, 'solr', None)
+            if solr is None:
+                solr = registry.solr = make_solr(registry.settings)
+    return solr
+
+
+def solr_date(value):
+    """Format a date the way Solr wants it, in UTC with a Z"""
+    if not hasattr(value, 'utctimetuple'):
+        value = dateutil.parser.parse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(tzutc()).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def first_content(value):
+    """The value of the first content element of an item. Any other
+    content elements are not indexed.
+    """
+    for content in value:
+        return content['value']
+    return None
+
+
+def copy_list(value):
+    return list(value)
+
+
+# The fields of a Solr document: the name of the field, the item
+# attribute it comes from, and the function converting its value.
+SOLR_FIELDS = (
+    ('uid', '__name__', None),
+    ('Title', 'Title', None),
+    ('portal_type', 'portal_type', None),
+    ('url', 'url', None),
+    ('Creator', 'Creator', None),
+    ('Modified', 'Modified', solr_date),
+    ('Description', 'Description', None),
+    ('Subject', 'Subject', copy_list),
+    ('Category', 'Category', None),
+    ('feed_type', 'feed_type', copy_list),
+    ('tile_urls', 'tile_urls', copy_list),
+    ('deleted_tile_urls', 'deleted_tile_urls', copy_list),
+    ('content', 'content', first_content),
+)
+
+
+# Multi valued fields that atomic updates change with `add` and
+# `remove` rather than setting all of their values again
+SET_FIELDS = ('feed_type', 'tile_urls', 'deleted_tile_urls')
+
+
+def solr_document(item, fields=SOLR_FIELDS):
+    """Turn a shared item into a document Solr can index.
+
+    Only the declared `fields` are read from the item, so nothing
+    else (like the __parent__ folder) is copied or sent to Solr.
+    Attributes the item doesn't have are left out. Fields missing
+    from the Solr schema are dropped by `update_documents`.
+    """
+    document = {}
+    for field, attr, convert in fields:
+        value = getattr(item, attr, None)
+        if value is None:
+            continue
+        if convert is not None:
+            value = convert(value)
+            if value is None:
+                continue
+        document[field] = value
+    return document
+
+
+def atomic_document(item, changes, fields=SOLR_FIELDS):
+    """A Solr atomic update of the fields of an item that changed.
+
+    `changes` maps the changed attributes to their previous values,
+    see `SharedItem.changed_fields`. The `SET_FIELDS` get `add` and
+    `remove` operations for the values that came and went, the other
+    fields are `set` again. Returns None if no indexed field changed.
+    """
+    document = {}
+    for field, attr, convert in fields:
+        if attr not in changes:
+            continue
+        value = getattr(item, attr, None)
+        if value is not None and convert is not None:
+            value = convert(value)
+        old = changes[attr]
+        if field in SET_FIELDS and old is not None and value is not None:
+            operations = {}
+            added = [v for v in value if v not in old]
+            if added:
+                operations['add'] = added
+            removed = [v for v in old if v not in value]
+            if removed:
+                operations['remove'] = removed
+            if operations:
+                document[field] = operations
+        else:
+            document[field] = {'set': value}
+    if not document:
+        return None
+    document['uid'] = item.__name__
+    return document
+
+
+class SolrSchema(object):
+    """The fields and dynamic fields of a Solr schema
+    """
+
+    def __init__(self, fields, dynamic_fields=()):
+        self.fields = dict((f['name'], f) for f in fields)
+        # Solr matches the longest dynamic field pattern first
+        self.dynamic_fields = sorted(
+            dynamic_fields, key=lambda f: -len(f['name']))
+        self._unknown = set()
+
+    def field(self, name):
+        """The definition of a field, or None if Solr doesn't know it
+        """
+        if name in self.fields:
+            return self.fields[name]
+        for field in self.dynamic_fields:
+            pattern = field['name']
+            if pattern.startswith('*') and name.endswith(pattern[1:]):
+                return field
+            if pattern.endswith('*') and name.startswith(pattern[:-1]):
+                return field
+        return None
+
+    def filter(self, document):
+        """Drop the fields of a document that are not in the schema,
+        and make the values fit the single or multi valued fields.
+        """
+        cleaned = {}
+        for name, value in document.items():
+            field = self.field(name)
+            if field is None:
+                if name not in self._unknown:
+                    self._unknown.add(name)
+                    logger.warn('Not indexing %s, it is not in the '
+                                'Solr schema' % name)
+                continue
+            if isinstance(value, dict):
+                # An atomic update, see `atomic_document`
+                value = dict((operation, self._fit(field, v))
+                             for operation, v in value.items())
+            else:
+                value = self._fit(field, value)
+                if value is None:
+                    continue
+            cleaned[name] = value
+        return cleaned
+
+    def _fit(self, field, value):
+        multi_valued = field.get('multiValued')
+        is_list = isinstance(value, (list, tuple))
+        if multi_valued is False and is_list:
+            if not value:
+                return None
+            value = value[0]
+        elif multi_valued and not is_list and value is not None:
+            value = [value]
+        if field.get('type') in DATE_TYPES and \
+                hasattr(value, 'utctimetuple'):
+            value = solr_date(value)
+        return value
+
+
+DATE_TYPES = ('date', 'tdate', 'pdate')
+
+
+def fetch_schema(solr):
+    """Get the schema from the Solr schema API. Returns None if the
+    client doesn't tell where Solr is.
+    """
+    base_url = getattr(solr, 'base_url', None)
+    if base_url is None:
+        return None
+    http = getattr(solr, 'make_request', requests)
+    base_url = base_url.rstrip('/') + '/'
+    params = {'wt': 'json', 'showDefaults': 'true'}
+    fields = http.get(base_url + 'schema/fields', params=params)
+    fields.raise_for_status()
+    dynamic = http.get(base_url + 'schema/dynamicfields', params=params)
+    dynamic.raise_for_status()
+    return SolrSchema(
+        fields.json()['fields'],
+        dynamic.json()['dynamicFields'],
+    )
+
+
+class SchemaCache(object):
+    """Keep the Solr schema for `ttl` seconds, so it is fetched once
+    per process rather than once per update.
+
+    If Solr can't be asked, the last schema known is kept. Without
+    any schema the documents are sent as they are.
+    """
+
+    def __init__(self, ttl=3600, fetch=fetch_schema):
+        self.ttl = ttl
+        self.fetch = fetch
+        self.schema = None
+        self.fetched = None
+        self._lock = threading.Lock()
+
+    def get(self, solr):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            now = time.time()
+            if self.fetched is None or now - self.fetched > self.ttl:
+                try:
+                    schema = self.fetch(solr)
+                except Exception:
+                    logger.exception('Could not get the Solr schema')
+                else:
+                    if schema is not None:
+                        self.schema = schema
+                # Don't ask again on every update when Solr is down
+                self.fetched = now
+            return self.schema
+
+    def invalidate(self):
+        with self._lock:
+            self.fetched = None
+
+
+schema_cache = SchemaCache()
+
+
+class Generation(object):
+    """Counts the writes to Solr, so that cached search results can
+    tell they may be out of date.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+
+
+solr_generation = Generation()
+
+
+def update_documents(solr, documents, **kwargs):
+    """Send documents to Solr, leaving out the fields it doesn't know.
+
+    If Solr still turns the update down with a 400, the schema may
+    have changed: it is fetched again and the update retried once.
+    """
+    schema = schema_cache.get(solr)
+    if schema is not None:
+        documents = [schema.filter(d) for d in documents]
+    response = solr.update(documents, **kwargs)
+    if getattr(response, 'status', None) == 400 and schema is not None:
+        logger.warn('Solr refused the update, reloading the schema')
+        schema_cache.invalidate()
+        schema = schema_cache.get(solr)
+        documents = [schema.filter(d) for d in documents]
+        response = solr.update(documents, **kwargs)
+    solr_generation.bump()
+    return response
+
+
+def quote(value):
+    """Quote a value for a Solr query"""
+    return u'"%s"' % value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+
+
+def uid_query(uids):
+    """A Solr query matching any of the uids"""
+    return u'uid:(%s)' % u' OR '.join(quote(uid) for uid in uids)
+
+
+def delete_documents(solr, uids, batch_size=DELETE_BATCH_SIZE,
+                     raise_errors=False):
+    """Remove the documents of the uids from Solr, `batch_size` uids
+    per query, and commit once at the end.
+
+    Returns a `(uid count, seconds)` tuple for each batch. With
+    `raise_errors` a `SolrError` is raised when Solr turns down one of
+    the requests.
+    """
+    uids = list(uids)
+    timings = []
+    for start in range(0, len(uids), batch_size):
+        chunk = uids[start:start + batch_size]
+        started = time.time()
+        # The query is sent as is inside the XML of the delete
+        response = solr.delete_by_query(
+            escape(uid_query(chunk)), commit=False)
+        if raise_errors:
+            check_response(response, 'delete')
+        timings.append((len(chunk), time.time() - started))
+    if timings:
+        response = solr.commit()
+        solr_generation.bump()
+        if raise_errors:
+            check_response(response, 'commit')
+    return timings
+
+
+def send_batch(solr, shared, batch):
+    """Send a batch of `(uid, operation)` tuples from the index queue
+    to Solr, using the current state of the items.
+
+    Raises a `SolrError` when Solr turns the batch down, so that it
+    stays in the queue.
+    """
+    documents = []
+    deleted = []
+    for uid, operation in batch:
+        item = shared.get(uid)
+        if operation == 'delete' or item is None:
+            deleted.append(uid)
+        else:
+            documents.append(solr_document(item))
+    if documents:
+        check_response(update_documents(solr, documents), 'update')
+    delete_documents(solr, deleted, raise_errors=True)
+    logger.info('Indexed %s and removed %s items' % (
+        len(documents), len(deleted)))
+
+
+class IndexWorker(threading.Thread):
+    """Drain the index queue of the application in the background.
+
+    Each run opens its own connection to the database, sends a batch
+    of the queued changes to Solr and removes them from the queue.
+    If a request queued the same item again in the meantime the
+    commit conflicts, and the item is sent again on the next run.
+    """
+
+    def __init__(self, db, solr=None, interval=1.0, batch_size=100,
+                 registry=None):
+        super(IndexWorker, self).__init__(name='pushhubsearch-indexer')
+        self.daemon = True
+        self.db = db
+        # Without a client, the one of the registry is used
+        self.solr = solr
+        self.registry = registry
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                while self.drain():
+                    pass
+            except Exception:
+                logger.exception('Failed to update the Solr index')
+
+    def stop(self):
+        self._stop_event.set()
+
+    def drain(self):
+        """Send one batch from the queue, returns its size"""
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager=tm)
+        try:
+            app_root = conn.root().get('app_root')
+            queue = getattr(app_root, 'index_queue', None)
+            if not queue:
+                return 0
+            batch = queue.peek(self.batch_size)
+            solr = self.solr
+            if solr is None:
+                solr = get_solr(self.registry)
+            send_batch(solr, app_root.shared, batch)
+            queue.done(batch)
+            tm.commit()
+            return len(batch)
+        except ConflictError:
+            logger.info('Index queue changed while indexing, retrying')
+            return 0
+        finally:
+            tm.abort()
+            conn.close()
+
+
+def start_index_worker(registry):
+    """Start indexing in the background, see `push.solr_async`
+    """
+    settings = registry.settings
+    db = registry._zodb_databases['']
+    worker = IndexWorker(
+        db,
+        registry=registry,
+        interval=float(settings.get('push.solr_async_interval', 1)),
+        batch_size=int(settings.get('push.solr_async_batch_size', 100)),
+    )
+    worker.start()
+    registry.index_worker = worker
+    return worker
@@ -28,39 +28,614 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import calendar
+import unicodedata
 from datetime import datetime
+from itertools import islice
 from persistent import Persistent
 from persistent.mapping import PersistentMapping
+from BTrees.LOBTree import LOBTree
+from BTrees.OLBTree import OLBTree
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from repoze.folder import Folder
+from repoze.folder import unicodify
+from ZODB.POSException import ConflictError
 import dateutil.parser
 from dateutil.tz import tzutc
 
+from .feedgen import entry_fragment
+
 import logging
 logger = logging.getLogger(__name__)
 
 
+def modified_key(modified):
+    """Return a number that sorts the newest `Modified` dates first.
+
+    Naive dates are treated as UTC, which is what `SharedItem` uses
+    when no date is given.
+    """
+    if not hasattr(modified, 'utctimetuple'):
+        try:
+            modified = dateutil.parser.parse(modified)
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            return 0.0
+    seconds = calendar.timegm(modified.utctimetuple())
+    return -(seconds + modified.microsecond / 1e6)
+
+
+def normalize_title(title):
+    """The form of a title used for lookups that ignore case and
+    spacing: NFKC normalized, case folded and with its whitespace
+    collapsed.
+    """
+    title = unicodedata.normalize('NFKC', u' '.join(title.split()))
+    # Python 2 has no casefold
+    return getattr(title, 'casefold', title.lower)()
+
+
+def as_text(value):
+    """Index values are text, so that they can be compared"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def text_values(values):
+    """The values to index for a field, leaving out the empty ones"""
+    return tuple(sorted(set(as_text(value) for value in values if value)))
+
+
+def window(keys, start=0, limit=None):
+    """Slice a sequence of sort keys"""
+    if limit is not None:
+        return keys[start:start + limit]
+    elif start:
+        return keys[start:]
+    return keys
+
+
+def smallest_set(sets):
+    """The smallest of the sets, found by walking them side by side so
+    that only as many keys are read as the smallest one has.
+    """
+    iterators = [iter(keys) for keys in sets]
+    while True:
+        for keys, iterator in zip(sets, iterators):
+            if next(iterator, None) is None:
+                return keys
+
+
+# The feeds an item can be in, stored as the bits of `SharedItem._feeds`
+FEED_NAMES = ('shared', 'selected', 'deleted')
+# The keys of a feedparser content dict, stored as a tuple
+CONTENT_KEYS = ('type', 'language', 'base', 'value')
+
+
+def feed_bits(names):
+    """The `SharedItem._feeds` bitmask for the feed names"""
+    bits = 0
+    for name in names:
+        if name not in FEED_NAMES:
+            raise ValueError('Unknown feed %r' % (name,))
+        bits |= 1 << FEED_NAMES.index(name)
+    return bits
+
+
+def compact_content(content):
+    """Store feedparser content dicts as tuples of `CONTENT_KEYS`"""
+    return tuple(
+        tuple(c.get(key) for key in CONTENT_KEYS) for c in content)
+
+
+def compact_state(state):
+    """Convert the state of an item pickled when its feeds and lists
+    were stored as lists, see `evolve`.
+    """
+    state = dict(state)
+    if 'feed_type' in state:
+        state['_feeds'] = feed_bits(state.pop('feed_type'))
+    if 'content' in state:
+        state['_content'] = compact_content(state.pop('content'))
+    for name in SharedItem.tuple_attributes:
+        if isinstance(state.get(name), list):
+            state[name] = tuple(state[name])
+    return state
+
+
+def merge_bits(old, saved, new):
+    """`merge_sets` for bitmasks"""
+    return (saved & (new | ~old)) | (new & ~old)
+
+
+def merge_sets(old, saved, new):
+    """Three-way merge of two concurrent changes to a list used as a
+    set: values added by either side are kept, values removed by
+    either side are dropped.
+    """
+    merged = [v for v in saved if v in new or v not in old]
+    merged.extend(v for v in new if v not in old and v not in saved)
+    return merged
+
+
 class Root(PersistentMapping):
     __parent__ = __name__ = None
+    # Bumped by every write to the pool, see `next_sequence`
+    sequence = 0
+    last_modified = None
+    # Created when Solr is updated in the background, see
+    # `views.index_queue`
+    index_queue = None
+
+    def next_sequence(self):
+        """Record a change to the pool and return its sequence number
+        """
+        self.sequence += 1
+        self.last_modified = datetime.now(tzutc())
+        return self.sequence
+
+    def record_change(self, uid):
+        """Stamp a created, updated or deleted item with the next
+        sequence number.
+        """
+        sequence = self.next_sequence()
+        self.shared.record_change(uid, sequence)
+        return sequence
+
+
+class IndexQueue(Persistent):
+    """Items waiting to be sent to Solr, see `indexing.IndexWorker`.
+
+    Only the last operation queued for an item is kept, so an item
+    updated many times is only indexed once.
+    """
+
+    def __init__(self):
+        self._pending = OOBTree()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __nonzero__(self):
+        return bool(self._pending)
+    __bool__ = __nonzero__
+
+    def index(self, uid):
+        self._pending[uid] = 'index'
+
+    def unindex(self, uid):
+        self._pending[uid] = 'delete'
+
+    def peek(self, size):
+        """The first `size` queued `(uid, operation)` tuples"""
+        return list(islice(self._pending.items(), size))
+
+    def done(self, batch):
+        """Remove a batch returned by `peek` from the queue"""
+        for uid, operation in batch:
+            if self._pending.get(uid) == operation:
+                del self._pending[uid]
+
+
+class EntryFragment(Persistent):
+    """The serialized entry of a shared item, stored in its own record
+    so that refreshing it doesn't store the entries of other items.
+    """
+
+    def __init__(self, data=b''):
+        # The `<entry>` of the item, utf-8 encoded
+        self.data = data
+
+    def _p_resolveConflict(self, old, saved, new):
+        """Both transactions refreshed the entry. Neither one is the
+        entry of the merged item, so the item itself is used until the
+        entry is refreshed again, see `SharedItems.fragments_of`.
+        """
+        if saved == new:
+            return saved
+        return dict(saved, data=b'')
 
 
 class SharedItems(Folder):
     """A folder to hold the shared items
+
+    The folder keeps secondary indexes of its items so that the views
+    don't have to wake up every item in the pool. Each index maps a
+    value to the set of sort keys of the items having that value. A
+    sort key is a `(modified_key, uid)` tuple, so iterating over a
+    set gives the items newest first.
+
+    The folder also keeps the serialized Atom entry of each item,
+    refreshed whenever the item is reindexed, which the global feeds
+    are put together from.
     """
     title = "Shared Items"
+    index_names = ('feed', 'title', 'title_normalized', 'tile',
+                   'deleted_tile', 'Category', 'Creator', 'portal_type',
+                   'Subject')
+    # Folders created before the indexes existed get them from
+    # `evolve.reindex_items`, see `needs_reindex`
+    _indexes = None
+    # uid -> the sort key of the item, and the `(uid, index name,
+    # value)` tuples it is indexed under. A value is a key of its own
+    # so that concurrent changes to different values of an item don't
+    # conflict.
+    _sort_keys = None
+    _indexed = None
+    # The `index_names` the indexes were completely built for
+    _indexes_built = None
+    # uid -> the `EntryFragment` of the item
+    _fragments = None
+    # The change log: sequence -> uid, uid -> sequence and, for the
+    # deleted items, uid -> deletion date
+    _changes = None
+    _change_sequences = None
+    _tombstones = None
+
+    def __init__(self, data=None):
+        super(SharedItems, self).__init__(data)
+        self.rebuild_indexes()
+        # Created up front so that the first changes don't all write
+        # to the folder itself and conflict
+        self._create_change_log()
 
-    def find_by_title(self, title):
-        matches = [v for v in self.values() if v.Title == title]
+    def add(self, name, other, send_events=True):
+        super(SharedItems, self).add(name, other, send_events=send_events)
+        self.index_item(unicodify(name), other)
+
+    def remove(self, name, *args, **kwargs):
+        name = unicodify(name)
+        other = super(SharedItems, self).remove(name, *args, **kwargs)
+        self.unindex_item(name)
+        return other
+
+    def find_by_title(self, title, normalized=False):
+        """The items titled `title`, newest first.
+
+        With `normalized` the titles are compared regardless of case
+        and spacing, see `normalize_title`.
+        """
+        if normalized:
+            keys = self.indexed_keys('title_normalized',
+                                     normalize_title(title))
+        else:
+            keys = self.indexed_keys('title', title)
+        return [self.data[sort_key[1]] for sort_key in keys]
+
+    def find_by_title_prefix(self, prefix, normalized=True, limit=None):
+        """The items with a title starting with `prefix`, in the order
+        of their titles and newest first for the same title.
+        """
+        name = 'title'
+        if normalized:
+            name = 'title_normalized'
+            prefix = normalize_title(prefix)
+        if self.needs_reindex():
+            found = sorted(
+                (title, (modified_key(item.Modified), uid))
+                for uid, item in self.items()
+                for title in item.index_values()[name]
+                if title.startswith(prefix))
+            return [self.data[sort_key[1]]
+                    for title, sort_key in found[:limit]]
+        matches = []
+        for title, keys in self._index(name).items(min=prefix):
+            if not title.startswith(prefix):
+                break
+            for sort_key in keys:
+                if limit is not None and len(matches) == limit:
+                    return matches
+                matches.append(self.data[sort_key[1]])
         return matches
 
+    def needs_reindex(self):
+        return (self._sort_keys is None or
+                self._indexes_built != self.index_names)
+
+    def clear_indexes(self):
+        """Start over with empty indexes, which the items are then
+        added to with `index_item`, see `evolve.reindex_items`. Items
+        added or changed in the meantime are indexed as usual.
+        """
+        logger.info('Clearing the indexes for %s' % self.title)
+        self._indexes = OOBTree()
+        for name in self.index_names:
+            self._indexes[name] = OOBTree()
+        self._sort_keys = OOBTree()
+        self._indexed = OOTreeSet()
+        self._fragments = OOBTree()
+        self._indexes_built = None
+
+    def indexes_built(self):
+        """Note that every item was indexed since `clear_indexes`"""
+        self._indexes_built = self.index_names
+
+    def rebuild_indexes(self):
+        """Index all of the items from scratch in the current
+        transaction, see `evolve.reindex_items` for large folders.
+        """
+        self.clear_indexes()
+        for uid, item in self.items():
+            self.index_item(uid, item)
+        self.indexes_built()
+
+    def _index(self, name):
+        if self._indexes is not None:
+            index = self._indexes.get(name)
+            if index is not None:
+                return index
+        # Not built yet, see `needs_reindex`
+        return OOBTree()
+
+    def index_item(self, uid, item):
+        """Add the item to the indexes, or refresh the values that
+        changed since it was last indexed.
+        """
+        if self._sort_keys is None:
+            # Indexed along with the others, see `clear_indexes`
+            return
+        if self._fragments is not None:
+            fragment = entry_fragment(item)
+            holder = self._fragments.get(uid)
+            if holder is None:
+                self._fragments[uid] = EntryFragment(fragment)
+            elif holder.data != fragment:
+                # Only the record of this item is stored again
+                holder.data = fragment
+        sort_key = (modified_key(item.Modified), uid)
+        if self._sort_keys.get(uid) != sort_key:
+            # Every set holds the old sort key
+            self._unindex(uid)
+            self._sort_keys[uid] = sort_key
+        for name, values in item.index_values().items():
+            previous = self._indexed_values(uid, name)
+            index = self._index(name)
+            for value in previous:
+                if value not in values:
+                    self._remove_key(index, value, sort_key)
+                    self._indexed.remove((uid, name, value))
+            for value in values:
+                if value not in previous:
+                    keys = index.get(value)
+                    if keys is None:
+                        keys = index[value] = OOTreeSet()
+                    keys.insert(sort_key)
+                    self._indexed.insert((uid, name, value))
+
+    def unindex_item(self, uid):
+        if self._sort_keys is None:
+            return
+        if uid in self._sort_keys:
+            self._unindex(uid)
+            del self._sort_keys[uid]
+        if self._fragments is not None and uid in self._fragments:
+            del self._fragments[uid]
+
+    def _indexed_values(self, uid, name):
+        keys = self._indexed.keys(
+            min=(uid, name), max=(uid, name + u'\x00'), excludemax=True)
+        return [key[2] for key in keys]
+
+    def _unindex(self, uid):
+        sort_key = self._sort_keys.get(uid)
+        keys = self._indexed.keys(
+            min=(uid, ), max=(uid + u'\x00', ), excludemax=True)
+        for key in list(keys):
+            uid, name, value = key
+            self._remove_key(self._index(name), value, sort_key)
+            self._indexed.remove(key)
+
+    def _remove_key(self, index, value, sort_key):
+        keys = index.get(value)
+        if keys is not None and sort_key in keys:
+            keys.remove(sort_key)
+            # Don't keep a set for every title ever used
+            if not keys:
+                del index[value]
+
+    def indexed_keys(self, name, value):
+        """The sort keys for the items with `value` in the `name`
+        index, newest first.
+        """
+        if self.needs_reindex():
+            # The indexes are missing or only partly built, see
+            # `evolve.reindex_items`, so look at every item instead
+            return OOTreeSet(
+                (modified_key(item.Modified), uid)
+                for uid, item in self.items()
+                if value in item.index_values()[name])
+        keys = self._index(name).get(value)
+        if keys is None:
+            return OOTreeSet()
+        return keys
+
+    def _create_change_log(self):
+        self._changes = LOBTree()
+        self._change_sequences = OLBTree()
+        self._tombstones = OOBTree()
+
+    def record_change(self, uid, sequence):
+        """Log the latest change of an item. Only the last change of
+        each item is kept.
+        """
+        if self._changes is None:
+            self._create_change_log()
+        previous = self._change_sequences.get(uid)
+        if previous is not None and previous in self._changes:
+            del self._changes[previous]
+        self._changes[sequence] = uid
+        self._change_sequences[uid] = sequence
+        item = self.data.get(uid)
+        if item is None:
+            self._tombstones[uid] = datetime.now(tzutc())
+        else:
+            if uid in self._tombstones:
+                del self._tombstones[uid]
+            item.sequence = sequence
+
+    def changes(self, since=0):
+        """Iterate over the items changed after the `since` sequence,
+        oldest change first.
+
+        Yields `(sequence, uid, item, deleted)` tuples, where `item` is
+        None and `deleted` the deletion date for the deleted items.
+        """
+        if self._changes is None:
+            return
+        for sequence, uid in self._changes.items(min=since, excludemin=True):
+            item = self.data.get(uid)
+            if item is None:
+                yield sequence, uid, None, self._tombstones.get(uid)
+            else:
+                yield sequence, uid, item, None
+
+    def feed_keys(self, feed_name, filters=()):
+        """The sort keys of the items in a global feed, newest first.
+
+        `filters` is a sequence of `(index name, value)` pairs, which
+        leaves only the items having each value in that index. The
+        smallest of the sets is walked and its keys are looked up in
+        the others, so a narrow filter is cheaper than the whole feed.
+        """
+        keys = self.indexed_keys('feed', feed_name)
+        if not filters:
+            return keys.keys()
+        sets = [keys]
+        for name, value in filters:
+            sets.append(self.indexed_keys(name, value))
+        walked = smallest_set(sets)
+        others = [keys for keys in sets if keys is not walked]
+        return [sort_key for sort_key in walked
+                if all(sort_key in keys for keys in others)]
+
+    def feed_count(self, feed_name, filters=()):
+        return len(self.feed_keys(feed_name, filters))
+
+    def feed_items(self, feed_name, start=0, limit=None, filters=()):
+        """Iterate over the items in a global feed, newest first.
+
+        `start` and `limit` select a window of the feed without
+        loading the items before it.
+        """
+        keys = self.feed_keys(feed_name, filters)
+        return self.items_of(window(keys, start, limit))
+
+    def feed_fragments(self, feed_name, start=0, limit=None, filters=()):
+        """Like `feed_items`, but yields the serialized entries of the
+        items, or the item itself for an entry that isn't kept yet.
+        """
+        keys = self.feed_keys(feed_name, filters)
+        return self.fragments_of(window(keys, start, limit))
+
+    def tile_items(self, tile_url, removed=False):
+        """The items placed on a tile, or removed from it, newest
+        first.
+        """
+        name = 'deleted_tile' if removed else 'tile'
+        return self.indexed_items(name, tile_url)
+
+    def indexed_items(self, name, value, start=0, limit=None):
+        """Iterate over the items with `value` in the `name` index,
+        newest first.
+        """
+        keys = self.indexed_keys(name, value).keys()
+        return self.items_of(window(keys, start, limit))
+
+    def indexed_fragments(self, name, value, start=0, limit=None):
+        """Like `indexed_items`, see `feed_fragments`"""
+        keys = self.indexed_keys(name, value).keys()
+        return self.fragments_of(window(keys, start, limit))
+
+    def items_of(self, sort_keys):
+        for sort_key in sort_keys:
+            yield self.data[sort_key[1]]
+
+    def fragments_of(self, sort_keys):
+        for sort_key in sort_keys:
+            uid = sort_key[1]
+            yield self.fragment(uid) or self.data[uid]
+
+    def fragment(self, uid):
+        """The serialized `<entry>` of an item, if it is kept"""
+        if self._fragments is None:
+            return None
+        holder = self._fragments.get(uid)
+        if holder is not None and holder.data:
+            return holder.data
+
+
+class Field(object):
+    """An attribute of a `SharedItem` that notes its previous value
+    when it changes, see `SharedItem.changed_fields`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, item, cls=None):
+        if item is None:
+            return self
+        try:
+            return item.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, item, value):
+        old = item.__dict__.get(self.name)
+        if self.name not in item.__dict__ or old != value:
+            item._note_change(self.name, old)
+        item.__dict__[self.name] = value
+
+    def __delete__(self, item):
+        if self.name not in item.__dict__:
+            raise AttributeError(self.name)
+        item._note_change(self.name, item.__dict__.pop(self.name))
+
+
+class ItemBody(Persistent):
+    """The content of a shared item, stored in its own record so that
+    it is only loaded when the content is used.
+    """
+
+    def __init__(self, content=()):
+        # Tuples of `CONTENT_KEYS`, see `compact_content`
+        self.content = content
+
 
 class SharedItem(Persistent):
     """An item shared to the CS Portal Pool
     """
 
+    # The feeds of the item as a bitmask of `FEED_NAMES`, see
+    # `feed_type`
+    _feeds = 0
+    # The `ItemBody` holding the content, see `content`
+    _body = None
+    # Where the content was kept before `ItemBody`, see `evolve`
+    _content = ()
+    # Attributes stored as tuples rather than lists
+    tuple_attributes = ('Subject', 'tile_urls', 'deleted_tile_urls')
+    # Tuples that `update_from_entry` treats as sets, merged set-wise
+    # when two transactions change the same item
+    set_attributes = ('tile_urls', 'deleted_tile_urls')
+
+    Title = Field('Title')
+    portal_type = Field('portal_type')
+    url = Field('url')
+    Creator = Field('Creator')
+    Modified = Field('Modified')
+    Description = Field('Description')
+    Subject = Field('Subject')
+    Category = Field('Category')
+    tile_urls = Field('tile_urls')
+    deleted_tile_urls = Field('deleted_tile_urls')
+    deletion_type = Field('deletion_type')
+
     def __init__(self, Title='', portal_type='', Creator='', Modified=None,
-                 url='', Description='', Subject=[], Category=None,
-                 feed_type=None, tile_urls=[], deleted_tile_urls=[],
-                 content=[]):
+                 url='', Description='', Subject=(), Category=None,
+                 feed_type=None, tile_urls=(), deleted_tile_urls=(),
+                 content=()):
         self.Title = Title
         self.portal_type = portal_type
         self.url = url
@@ -70,24 +645,92 @@ class SharedItem(Persistent):
         else:
             self.Modified = Modified
         self.Description = Description
-        self.Subject = Subject
+        self.Subject = tuple(Subject)
         self.Category = Category
-        if feed_type is None:
-            self.feed_type = []
-        else:
-            self.feed_type = feed_type
-        self.tile_urls = tile_urls
-        self.deleted_tile_urls = deleted_tile_urls
+        self.feed_type = feed_type or ()
+        self.tile_urls = tuple(tile_urls)
+        self.deleted_tile_urls = tuple(deleted_tile_urls)
         self.content = content
 
+    def __setstate__(self, state):
+        super(SharedItem, self).__setstate__(compact_state(state))
+
+    def _note_change(self, name, old):
+        changes = getattr(self, '_v_changes', None)
+        if changes is None:
+            changes = self._v_changes = {}
+        changes.setdefault(name, old)
+
+    def changed_fields(self):
+        """The fields changed since the item was loaded or since
+        `clear_changes`, mapped to their previous values. Fields that
+        were not set before map to None.
+        """
+        return dict(getattr(self, '_v_changes', None) or {})
+
+    def clear_changes(self):
+        self._v_changes = {}
+
+    def _get_feed_type(self):
+        return tuple(name for bit, name in enumerate(FEED_NAMES)
+                     if self._feeds & 1 << bit)
+
+    def _set_feeds(self, feeds):
+        if feeds != self._feeds:
+            self._note_change('feed_type', self.feed_type)
+            self._feeds = feeds
+
+    def _set_feed_type(self, value):
+        self._set_feeds(feed_bits(value))
+
+    feed_type = property(
+        _get_feed_type, _set_feed_type,
+        doc="The names of the feeds the item is in, as a tuple")
+
+    def add_feed(self, name):
+        self._set_feeds(self._feeds | feed_bits([name]))
+
+    def remove_feed(self, name):
+        self._set_feeds(self._feeds & ~feed_bits([name]))
+
+    def _get_content(self):
+        if self._body is None:
+            content = self._content
+        else:
+            content = self._body.content
+        return [dict((key, value) for key, value in zip(CONTENT_KEYS, c)
+                     if value is not None)
+                for c in content]
+
+    def set_content(self, value):
+        """Set the content. Unlike assigning `content`, which always
+        marks the item as changed, only the body is stored again when
+        the item already has one.
+        """
+        content = compact_content(value)
+        if self._body is None:
+            if content != self._content:
+                self._note_change('content', self.content)
+            if content or '_content' in self.__dict__:
+                self._body = ItemBody(content)
+            if '_content' in self.__dict__:
+                del self._content
+        elif self._body.content != content:
+            self._note_change('content', self.content)
+            # Only the body is stored again
+            self._body.content = content
+
+    content = property(
+        _get_content, set_content,
+        doc="The feedparser content dicts of the item, kept in an "
+            "`ItemBody`")
+
     def update_from_entry(self, entry):
         """Update the item based on the feed entry
 
-        NOTE: If you add any new attributes to the entry, you must
-              make sure that these are compatible with the Solr schema.
-              If they are not, then you need to modify the
-              _update_index method in views to remove the attr.
-              Otherwise, Solr will return a 400 on indexing.
+        NOTE: Attributes are only sent to Solr once they are added to
+              `indexing.SOLR_FIELDS`. Fields that are not in the Solr
+              schema are left out when indexing.
         """
         logger.debug('update_from_entry')
         if 'title' in entry:
@@ -107,11 +750,11 @@ class SharedItem(Persistent):
         if content:
             # NOTE content is not a string; it is a list of dicts. See:
             # http://pythonhosted.org/feedparser/common-atom-elements.html#accessing-common-entry-elements
-            self.content = content
+            self.set_content(content)
         if 'tags' in entry:
-            self.Subject = [
+            self.Subject = tuple(
                 i['term'] for i in entry['tags']
-                if i.get('label', '') != 'Site Title']
+                if i.get('label', '') != 'Site Title')
         if 'category' in entry:
             cats = [
                 i['term'] for i in entry['tags']
@@ -126,7 +769,7 @@ class SharedItem(Persistent):
             if len(self.feed_type) == 1 and 'deleted' in self.feed_type:
                 # If the item was completely removed, reset the tile_urls
                 previous_tile_urls = self.tile_urls
-                self.tile_urls = []
+                self.tile_urls = ()
             else:
                 current_tiles = set(self.tile_urls)
                 push_tile_urls = entry['push_tile_urls'].strip()
@@ -138,10 +781,10 @@ class SharedItem(Persistent):
                 else:
                     parsed_tiles = set()
                 # Clean up the deleted_tiles
-                self.deleted_tile_urls = list(
+                self.deleted_tile_urls = tuple(
                     set(self.deleted_tile_urls) - parsed_tiles)
                 # return a union of the passed in and current values
-                self.tile_urls = list(current_tiles | parsed_tiles)
+                self.tile_urls = tuple(current_tiles | parsed_tiles)
         if 'push_deleted_tile_urls' in entry:
             if len(self.feed_type) == 1 and 'deleted' in self.feed_type:
                 # If the item was completely removed, reset the
@@ -159,48 +802,116 @@ class SharedItem(Persistent):
                 else:
                     parsed_tiles = set()
                 # Clean up tile_urls by removing the item that was deleted
-                self.tile_urls = list(set(self.tile_urls) - parsed_tiles)
+                self.tile_urls = tuple(set(self.tile_urls) - parsed_tiles)
                 # return a union of the passed in and current values
-                self.deleted_tile_urls = list(current_tiles | parsed_tiles)
+                self.deleted_tile_urls = tuple(current_tiles | parsed_tiles)
+        self.reindex()
         # Report what the current state of the item is
         for k, v in self.__dict__.items():
             logger.debug('update entry: %s: %s' % (k, v))
 
+    def _p_resolveConflict(self, old, saved, new):
+        """Merge the changes of two transactions to the item.
+
+        The feeds and `set_attributes` are merged set-wise. Any other
+        attribute may only be changed by one of the transactions,
+        except `sequence` which keeps the latest change.
+        """
+        old, saved, new = [compact_state(s) for s in (old, saved, new)]
+        resolved = {}
+        missing = object()
+        for name in set(old) | set(saved) | set(new):
+            old_value = old.get(name, missing)
+            saved_value = saved.get(name, missing)
+            new_value = new.get(name, missing)
+            if name == '_feeds':
+                value = merge_bits(
+                    old.get(name, 0), saved.get(name, 0), new.get(name, 0))
+            elif name in self.set_attributes:
+                value = tuple(merge_sets(
+                    old.get(name, ()), saved.get(name, ()), new.get(name, ())))
+            elif saved_value == new_value or new_value == old_value:
+                value = saved_value
+            elif saved_value == old_value:
+                value = new_value
+            elif name == 'sequence' and missing not in (saved_value,
+                                                        new_value):
+                value = max(saved_value, new_value)
+            else:
+                raise ConflictError('Both transactions changed %s' % name)
+            if value is not missing:
+                resolved[name] = value
+        return resolved
+
+    def global_feeds(self):
+        """The names of the global feeds that list this item.
+
+        Items removed from a featured spot are only listed in the
+        deleted feed.
+        """
+        feed_type = set(self.feed_type)
+        featured_deletion = (
+            'deleted' in feed_type and
+            getattr(self, 'deletion_type', None) == 'featured'
+        )
+        if featured_deletion:
+            feed_type = feed_type & set(['deleted'])
+        return tuple(sorted(feed_type))
+
+    def index_values(self):
+        """The values stored for this item in the `SharedItems` indexes
+        """
+        title = as_text(self.Title)
+        return {
+            'feed': self.global_feeds(),
+            'title': (title, ),
+            'title_normalized': (normalize_title(title), ),
+            # Sorted, so the record doesn't change with the set order
+            'tile': tuple(sorted(set(self.tile_urls))),
+            'deleted_tile': tuple(sorted(set(self.deleted_tile_urls))),
+            'Category': text_values([self.Category]),
+            'Creator': text_values([self.Creator]),
+            'portal_type': text_values([self.portal_type]),
+            'Subject': text_values(self.Subject),
+        }
+
+    def reindex(self):
+        """Update the indexes of the folder holding this item
+        """
+        parent = getattr(self, '__parent__', None)
+        name = getattr(self, '__name__', None)
+        if isinstance(parent, SharedItems) and name in parent:
+            parent.index_item(name, self)
+
     def assign_feeds(self, feed_link='', push_deletion_type='', **kwargs):
         not_del_msg = "feed_type is not 'deleted' adding '%s'"
         del_sel_msg = "feed_type is 'deleted' and 'selected'"
         del_other_msg = "feed_type is 'deleted' deletion type '%s'"
         if 'shared' in feed_link:
             logger.debug("init feed_type '%s'" % 'shared')
-            if not self.feed_type:
-                self.feed_type = ['shared', ]
-            if 'shared' not in self.feed_type:
-                self.feed_type.append('shared')
-            if 'deleted' in self.feed_type:
-                self.feed_type.remove('deleted')
+            self.add_feed('shared')
+            self.remove_feed('deleted')
         elif 'deleted' in feed_link:
             if 'shared' not in self.feed_type:
                 logger.debug('tried to delete unshared item')
                 return
             if push_deletion_type == 'selected':
                 logger.debug(del_sel_msg)
-                if 'selected' in self.feed_type:
-                    self.feed_type.remove('selected')
-                if 'deleted' not in self.feed_type:
-                    self.feed_type.append('deleted')
+                self.remove_feed('selected')
+                self.add_feed('deleted')
             elif push_deletion_type == 'featured':
                 logger.debug('unfeatured item')
-                self.feed_type = ['deleted']
+                self.feed_type = ('deleted', )
             else:
                 logger.debug(del_other_msg % push_deletion_type)
-                self.feed_type.append('deleted')
+                self.add_feed('deleted')
         elif 'selected' in feed_link:
             if 'shared' not in self.feed_type:
                 logger.debug('tried to select unshared item')
                 return
             if 'selected' not in self.feed_type:
                 logger.debug(not_del_msg % 'selected')
-                self.feed_type.append('selected')
+                self.add_feed('selected')
 
 
 def appmaker(zodb_root):
@@ -215,4 +926,10 @@ def appmaker(zodb_root):
 
         import transaction
         transaction.commit()
-    return zodb_root['app_root']
+    app_root = zodb_root['app_root']
+    if app_root.shared.needs_reindex():
+        # Indexing every item would hold up the request, and conflict
+        # with every push while it runs
+        logger.warning('The shared items need to be reindexed, run '
+                       'pushhubsearch_evolve')
+    return app_root
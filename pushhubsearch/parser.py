@@ -0,0 +1,216 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# A streaming parser for the Atom feeds the hub pushes to us.
+#
+# `feedparser` copes with any feed thrown at it, but sniffing encodings,
+# sanitizing HTML and building the full entry dicts is most of the cost
+# of a large update. The hub always sends the same Atom shape, so the
+# entries are read with `iterparse` instead, keeping only what
+# `SharedItem.update_from_entry` uses. Anything unexpected is handed
+# over to `feedparser`.
+
+from io import BytesIO
+
+try:
+    from urlparse import urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urljoin
+
+try:
+    from xml.etree import cElementTree as etree
+except ImportError:  # Python 3
+    from xml.etree import ElementTree as etree
+
+import feedparser
+
+import logging
+logger = logging.getLogger(__name__)
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+PUSH_NS = 'http://ucla.edu/#portal-pool'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+FEED = '{%s}feed' % ATOM_NS
+ENTRY = '{%s}entry' % ATOM_NS
+LINK = '{%s}link' % ATOM_NS
+XML_BASE = '{%s}base' % XML_NS
+XML_LANG = '{%s}lang' % XML_NS
+
+# Atom text constructs, named like the keys feedparser gives them
+TEXT_ELEMENTS = {
+    '{%s}id' % ATOM_NS: 'id',
+    '{%s}title' % ATOM_NS: 'title',
+    '{%s}updated' % ATOM_NS: 'updated',
+    '{%s}summary' % ATOM_NS: 'summary',
+}
+CONTENT = '{%s}content' % ATOM_NS
+CATEGORY = '{%s}category' % ATOM_NS
+AUTHOR = '{%s}author' % ATOM_NS
+AUTHOR_NAME = '{%s}name' % ATOM_NS
+AUTHOR_EMAIL = '{%s}email' % ATOM_NS
+DC_CREATOR = '{%s}creator' % DC_NS
+DC_SUBJECT = '{%s}subject' % DC_NS
+
+CONTENT_TYPES = {
+    'text': 'text/plain',
+    'html': 'text/html',
+}
+
+
+class UnsupportedFeed(ValueError):
+    """The feed is not in the shape the hub sends"""
+
+
+def _text(element):
+    if len(element):
+        # xhtml content, leave it to feedparser
+        raise UnsupportedFeed('Unexpected markup in %s' % element.tag)
+    return (element.text or u'').strip()
+
+
+def _entry(element, base, lang):
+    """Turn an Atom entry element into a dict like feedparser's"""
+    entry = {}
+    tags = []
+    for child in element:
+        tag = child.tag
+        if tag in TEXT_ELEMENTS:
+            entry[TEXT_ELEMENTS[tag]] = _text(child)
+        elif tag == LINK:
+            rel = child.get('rel', 'alternate')
+            if rel == 'alternate' and 'link' not in entry:
+                entry['link'] = urljoin(
+                    child.get(XML_BASE, base), child.get('href', u''))
+        elif tag == CONTENT:
+            content_type = child.get('type', 'text')
+            entry.setdefault('content', []).append({
+                'type': CONTENT_TYPES.get(content_type, content_type),
+                'language': child.get(XML_LANG, lang),
+                'base': child.get(XML_BASE, base),
+                'value': _text(child),
+            })
+        elif tag == CATEGORY:
+            tags.append({
+                'term': child.get('term'),
+                'scheme': child.get('scheme'),
+                'label': child.get('label'),
+            })
+        elif tag == DC_SUBJECT:
+            tags.append({'term': _text(child), 'scheme': None, 'label': None})
+        elif tag == AUTHOR:
+            name = child.findtext(AUTHOR_NAME, u'').strip()
+            email = child.findtext(AUTHOR_EMAIL, u'').strip()
+            entry['author'] = email and u'%s (%s)' % (name, email) or name
+        elif tag == DC_CREATOR:
+            entry['author'] = _text(child)
+        elif tag.startswith('{%s}' % PUSH_NS):
+            entry['push_' + tag[len(PUSH_NS) + 2:]] = _text(child)
+    if tags:
+        entry['tags'] = tags
+        entry['category'] = tags[0]['term']
+    if 'id' not in entry:
+        raise UnsupportedFeed('An entry without an id')
+    return entry
+
+
+def iterparse_entries(body):
+    """Yield the entries of an Atom feed one at a time, each with the
+    `feed_link` of the feed.
+
+    Raises `UnsupportedFeed` when the feed isn't plain Atom.
+    """
+    feed_link = None
+    # The xml:base and xml:lang in effect for each open element
+    context = [(u'', None)]
+    depth = 0
+    events = etree.iterparse(BytesIO(body), events=('start', 'end'))
+    for event, element in events:
+        if event == 'start':
+            if depth == 0 and element.tag != FEED:
+                raise UnsupportedFeed('Not an Atom feed: %s' % element.tag)
+            base, lang = context[-1]
+            context.append((
+                urljoin(base, element.get(XML_BASE, u'')),
+                element.get(XML_LANG, lang),
+            ))
+            depth += 1
+            continue
+        depth -= 1
+        context.pop()
+        if depth == 1 and element.tag == LINK:
+            if element.get('rel', 'alternate') == 'alternate':
+                feed_link = feed_link or element.get('href')
+        elif depth == 1 and element.tag == ENTRY:
+            if feed_link is None:
+                raise UnsupportedFeed('An entry before the feed link')
+            entry = _entry(element, *context[-1])
+            entry['feed_link'] = feed_link
+            # Entries are only needed once, keep the memory flat
+            element.clear()
+            yield entry
+
+
+def feedparser_entries(body):
+    """Yield the entries `feedparser` finds, each with the `feed_link`
+    of the feed.
+    """
+    shared_content = feedparser.parse(body)
+    feed_link = shared_content.feed.get('link', u'')
+    for entry in shared_content.entries:
+        entry['feed_link'] = feed_link
+        yield entry
+
+
+def parse_entries(body, fast=False):
+    """Yield the entries of a pushed feed.
+
+    With `fast` the entries are read with `iterparse_entries`, falling
+    back to `feedparser` for the entries that it can't handle.
+    """
+    if not fast:
+        for entry in feedparser_entries(body):
+            yield entry
+        return
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    count = 0
+    try:
+        for entry in iterparse_entries(body):
+            yield entry
+            count += 1
+    except (UnsupportedFeed, SyntaxError) as e:
+        # ParseError is a SyntaxError
+        logger.info('Falling back to feedparser: %s' % e)
+        fallback = feedparser_entries(body)
+        for index, entry in enumerate(fallback):
+            if index >= count:
+                yield entry
@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Turn the searches of the `/search` view into Solr queries.
+#
+# A search is a list of terms, e.g.:
+#
+#     budget "board meeting" category:"School of Law" subject:news
+#     feed:selected modified:2013-01-01..2013-02-01
+#
+# Words and quoted phrases are searched for in the text of the items,
+# and all of them have to be found. `name:value` terms only keep the
+# items with that value in a field, see `SEARCH_FIELDS`, and
+# `modified:FROM..TO` the items modified between two dates, either of
+# which can be left out.
+
+import re
+import time
+
+import dateutil.parser
+
+from .indexing import quote
+from .indexing import solr_date
+from .indexing import solr_generation
+from .utils import LRUCache
+
+# The names of the filters a search can use, and their Solr fields
+SEARCH_FIELDS = {
+    'category': 'Category',
+    'creator': 'Creator',
+    'feed': 'feed_type',
+    'feed_type': 'feed_type',
+    'subject': 'Subject',
+    'type': 'portal_type',
+}
+
+# A `name:` prefix, then a quoted phrase or a word
+TERM_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))', re.UNICODE)
+
+
+def parse_date(value):
+    try:
+        return solr_date(dateutil.parser.parse(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('Not a date: %s' % value)
+
+
+class Search(object):
+    """A parsed search, see the module docstring
+    """
+
+    def __init__(self, text=(), filters=(), modified=(None, None)):
+        self.text = tuple(text)
+        self.filters = tuple(filters)
+        self.modified = tuple(modified)
+
+    @classmethod
+    def parse(cls, query):
+        """Parse a search, raises a ValueError for bad dates"""
+        text = []
+        filters = []
+        modified = (None, None)
+        for match in TERM_RE.finditer(query):
+            name, phrase, word = match.groups()
+            value = word if phrase is None else phrase
+            if name == 'modified':
+                start, sep, end = value.partition(u'..')
+                if not sep:
+                    end = start
+                modified = (start and parse_date(start) or None,
+                            end and parse_date(end) or None)
+            elif name in SEARCH_FIELDS:
+                filters.append((SEARCH_FIELDS[name], value))
+            else:
+                # An unknown name is part of the text, e.g. a URL
+                text.append(value if name is None else
+                            u'%s:%s' % (name, value))
+        return cls([t for t in text if t], filters, modified)
+
+    def key(self):
+        """Tells apart the searches that would give different results,
+        regardless of the order or spacing of their terms.
+        """
+        return (
+            tuple(sorted(set(self.text))),
+            tuple(sorted(set(self.filters))),
+            self.modified,
+        )
+
+    def solr_params(self, rows, text_fields=None):
+        """The Solr search parameters, asking for the uids of the first
+        `rows` items found. The text is searched in `text_fields`, in
+        the edismax `qf` format, or in the default field of the core.
+        """
+        params = {'rows': rows, 'fl': 'uid'}
+        if self.text:
+            params['q'] = u' AND '.join(quote(t) for t in self.text)
+            params['sort'] = 'score desc, Modified desc'
+            if text_fields:
+                params['defType'] = 'edismax'
+                params['qf'] = text_fields
+        else:
+            params['q'] = '*:*'
+            params['sort'] = 'Modified desc'
+        fq = [u'%s:%s' % (field, quote(value))
+              for field, value in sorted(set(self.filters))]
+        if self.modified != (None, None):
+            start, end = self.modified
+            fq.append(u'Modified:[%s TO %s]' % (start or '*', end or '*'))
+        if fq:
+            params['fq'] = fq
+        return params
+
+
+class SearchCache(object):
+    """Keep the uids found by the latest searches for `ttl` seconds,
+    or until the next write to Solr.
+    """
+
+    def __init__(self, size=128, ttl=60):
+        self.ttl = ttl
+        self._cache = LRUCache(size)
+
+    def get(self, key):
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        generation, expires, uids = cached
+        if generation != solr_generation.value or expires < time.time():
+            return None
+        return uids
+
+    def set(self, key, uids, generation):
+        """Keep the uids of a search. `generation` is the value of
+        `solr_generation` before the search was sent, so results that
+        crossed a write are never used.
+        """
+        self._cache.set(key, (generation, time.time() + self.ttl, uids))
@@ -0,0 +1,214 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Write the global feeds to files, for a web server to serve them.
+#
+# The feeds are written to the `push.snapshot_dir` directory, either by
+# running:
+#
+#     pushhubsearch_snapshot production.ini [directory]
+#
+# or, while the application runs, in the background once a request has
+# changed the pool. Each file is written under a temporary name and
+# renamed, so a reader never sees a partial feed.
+
+import os
+import sys
+import tempfile
+import threading
+
+import transaction
+from pyramid.paster import bootstrap
+from pyramid.request import Request
+
+from .views import GLOBAL_FEEDS
+from .views import render_global_feed
+
+import logging
+logger = logging.getLogger(__name__)
+
+# The feed name and file name of each snapshot
+SNAPSHOT_FILES = (
+    ('shared', 'global-shared.xml'),
+    ('selected', 'global-selected.xml'),
+    ('deleted', 'global-deletions.xml'),
+)
+
+# os.rename doesn't replace an existing file on Windows
+replace = getattr(os, 'replace', os.rename)
+
+
+def write_atomically(path, chunks):
+    """Write the chunks to a temporary file next to `path`, then move
+    it over `path`.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in chunks:
+                temp_file.write(chunk)
+        # mkstemp only lets the owner read the file
+        os.chmod(temp_path, 0o644)
+        replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def snapshot_request(registry):
+    """A request to generate the feed links with, for the application
+    URL in `push.snapshot_url`.
+    """
+    base_url = registry.settings.get('push.snapshot_url', 'http://localhost')
+    request = Request.blank('/', base_url=base_url)
+    request.registry = registry
+    return request
+
+
+def write_snapshots(app_root, directory, request):
+    """Write the unpaged global feeds to `directory`, returns the paths
+    of the files.
+    """
+    paths = []
+    for feed_name, file_name in SNAPSHOT_FILES:
+        title, description = GLOBAL_FEEDS[feed_name]
+        path = os.path.join(directory, file_name)
+        write_atomically(path, render_global_feed(
+            app_root, request, feed_name, title, description, 1, None))
+        paths.append(path)
+    return paths
+
+
+class SnapshotWriter(threading.Thread):
+    """Write the snapshots in the background when the pool changed.
+
+    A change is waited upon for `delay` seconds before the snapshots
+    are written, so that all of the pushes of a burst are written out
+    at once. Changes made while writing cause another write.
+    """
+
+    def __init__(self, db, registry, directory, delay=5.0):
+        super(SnapshotWriter, self).__init__(name='pushhubsearch-snapshots')
+        self.daemon = True
+        self.db = db
+        self.registry = registry
+        self.directory = directory
+        self.delay = delay
+        self._changed = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            self._changed.wait()
+            if self._stop_event.wait(self.delay):
+                break
+            self._changed.clear()
+            try:
+                self.write()
+            except Exception:
+                logger.exception('Failed to write the feed snapshots')
+
+    def stop(self):
+        self._stop_event.set()
+        self._changed.set()
+
+    def schedule(self):
+        """Write the snapshots once the delay is over"""
+        self._changed.set()
+
+    def committed(self, status):
+        if status:
+            self.schedule()
+
+    def schedule_on_commit(self, txn):
+        """Write the snapshots if the transaction is committed"""
+        for hook, args, kwargs in txn.getAfterCommitHooks():
+            if hook == self.committed:
+                return
+        txn.addAfterCommitHook(self.committed)
+
+    def write(self):
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager=tm)
+        try:
+            app_root = conn.root().get('app_root')
+            if app_root is None:
+                return []
+            paths = write_snapshots(
+                app_root, self.directory, snapshot_request(self.registry))
+            logger.info('Wrote the feed snapshots to %s' % self.directory)
+            return paths
+        finally:
+            tm.abort()
+            conn.close()
+
+
+def start_snapshot_writer(registry):
+    """Write the snapshots in the background, see `push.snapshot_dir`
+    """
+    settings = registry.settings
+    db = registry._zodb_databases['']
+    writer = SnapshotWriter(
+        db,
+        registry,
+        settings['push.snapshot_dir'],
+        delay=float(settings.get('push.snapshot_delay', 5)),
+    )
+    writer.start()
+    # Write the snapshots of the pool as it is now
+    writer.schedule()
+    registry.snapshot_writer = writer
+    return writer
+
+
+def main(argv=sys.argv):
+    if len(argv) not in (2, 3):
+        sys.stderr.write('usage: %s config_uri [directory]\n' % argv[0])
+        return 1
+    env = bootstrap(argv[1])
+    try:
+        registry = env['registry']
+        if len(argv) == 3:
+            directory = argv[2]
+        else:
+            directory = registry.settings.get('push.snapshot_dir')
+        if not directory:
+            sys.stderr.write('No directory given, and push.snapshot_dir '
+                             'is not set\n')
+            return 1
+        paths = write_snapshots(
+            env['root'], directory, snapshot_request(registry))
+        for path in paths:
+            sys.stdout.write('Wrote %s\n' % path)
+    finally:
+        env['closer']()
+    return 0
@@ -0,0 +1,149 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from datetime import datetime
+from unittest import TestCase
+from xml.dom.minidom import parseString
+
+from dateutil.tz import tzutc
+
+from pushhubsearch.feedgen import Atom1Feed
+from pushhubsearch.feedgen import entry_fragment
+from pushhubsearch.feedgen import feed_item
+from pushhubsearch.models import SharedItem
+
+
+def xml_tree(node):
+    """Reduce a DOM node to something comparable"""
+    if node.nodeType == node.TEXT_NODE:
+        return node.data
+    return (
+        node.tagName,
+        sorted(node.attributes.items()),
+        [xml_tree(child) for child in node.childNodes],
+    )
+
+
+class TestStream(TestCase):
+
+    def setUp(self):
+        self.items = [
+            ((u'New', u'http://example.com/new', u'The new one'), {
+                'pubdate': datetime(2013, 1, 2, tzinfo=tzutc()),
+                'unique_id': u'urn:syndication:new',
+                'push:portal_type': u'Document',
+            }),
+            ((u'Old', u'http://example.com/old', u'The old one'), {
+                'pubdate': datetime(2013, 1, 1, tzinfo=tzutc()),
+                'unique_id': u'urn:syndication:old',
+                'push:portal_type': u'Event',
+            }),
+        ]
+
+    def _feed(self, **kwargs):
+        return Atom1Feed(
+            title=u'Feed',
+            link=u'http://example.com',
+            description=u'A feed',
+            **kwargs
+        )
+
+    def test_same_as_write_string(self):
+        feed = self._feed()
+        for args, kwargs in self.items:
+            feed.add_item(*args, **kwargs)
+        expected = feed.writeString('utf-8')
+        if not isinstance(expected, bytes):
+            expected = expected.encode('utf-8')
+        streamed = b''.join(self._feed().stream(self.items))
+        self.assertEqual(
+            xml_tree(parseString(streamed).documentElement),
+            xml_tree(parseString(expected).documentElement),
+        )
+
+    def test_yields_per_entry(self):
+        chunks = list(self._feed().stream(self.items))
+        # header, one chunk per entry and the closing tag
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(b'New' in chunks[1])
+        self.assertTrue(b'Old' in chunks[2])
+
+    def test_items_are_not_kept(self):
+        feed = self._feed()
+        list(feed.stream(self.items))
+        self.assertEqual(feed.items, [])
+
+    def test_push_namespace(self):
+        streamed = b''.join(self._feed().stream(self.items))
+        root = parseString(streamed).documentElement
+        self.assertEqual(
+            root.getAttribute('xmlns:push'),
+            'http://ucla.edu/#portal-pool',
+        )
+
+    def test_paging_links(self):
+        links = [('next', u'http://example.com/?page=2')]
+        streamed = b''.join(self._feed(paging_links=links).stream([]))
+        dom = parseString(streamed)
+        rels = [l.getAttribute('rel')
+                for l in dom.getElementsByTagName('link')]
+        self.assertTrue('next' in rels)
+
+
+class TestEntryFragment(TestCase):
+
+    def setUp(self):
+        self.item = SharedItem(
+            Title=u'Caf\xe9 & more',
+            url=u'http://example.com/cafe',
+            Modified=datetime(2013, 1, 2, tzinfo=tzutc()),
+            Subject=[u'food'],
+            content=[{'type': 'text/html', 'value': u'<p>Hi</p>'}],
+        )
+        self.item.__name__ = u'cafe'
+
+    def _feed(self, **kwargs):
+        return Atom1Feed(
+            title=u'Feed',
+            link=u'http://example.com',
+            description=u'A feed',
+            **kwargs
+        )
+
+    def test_same_as_streamed(self):
+        chunks = list(self._feed().stream([feed_item(self.item)]))
+        self.assertEqual(entry_fragment(self.item), chunks[1])
+
+    def test_streamed_as_is(self):
+        updated = self.item.Modified
+        expected = b''.join(self._feed().stream([feed_item(self.item)]))
+        streamed = b''.join(self._feed(updated=updated).stream(
+            [entry_fragment(self.item)]))
+        self.assertEqual(streamed, expected)
@@ -0,0 +1,382 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from datetime import datetime
+from unittest import TestCase
+
+import transaction
+from pyramid import testing
+from ZODB import DB
+
+from dateutil.tz import tzoffset
+from mock import patch
+
+from pushhubsearch.indexing import IndexWorker
+from pushhubsearch.indexing import SchemaCache
+from pushhubsearch.indexing import SolrError
+from pushhubsearch.indexing import SolrSchema
+from pushhubsearch.indexing import atomic_document
+from pushhubsearch.indexing import delete_documents
+from pushhubsearch.indexing import make_solr
+from pushhubsearch.indexing import update_documents
+from pushhubsearch.indexing import solr_date
+from pushhubsearch.indexing import solr_document
+from pushhubsearch.indexing import uid_query
+from pushhubsearch.models import IndexQueue
+from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
+from pushhubsearch.models import appmaker
+from .test_views import FakeSolr
+
+
+class TestIndexWorker(TestCase):
+
+    def setUp(self):
+        testing.setUp()
+        self.db = DB(None)
+        conn = self.db.open()
+        root = appmaker(conn.root())
+        root.index_queue = IndexQueue()
+        for uid in ('foo', 'bar'):
+            root.shared[uid] = SharedItem(Title=uid)
+            root.index_queue.index(uid)
+        root.index_queue.unindex('gone')
+        transaction.commit()
+        conn.close()
+        self.solr = FakeSolr()
+        self.worker = IndexWorker(self.db, self.solr, batch_size=2)
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+        testing.tearDown()
+
+    def _queue(self):
+        conn = self.db.open()
+        try:
+            return conn.root()['app_root'].index_queue.peek(10)
+        finally:
+            conn.close()
+
+    def test_drain(self):
+        self.assertEqual(self.worker.drain(), 2)
+        self.assertEqual(
+            [d['uid'] for d in self.solr.updated[0]], ['bar', 'foo'])
+        self.assertEqual(self._queue(), [('gone', 'delete')])
+        self.assertEqual(self.worker.drain(), 1)
+        self.assertEqual(self.solr.deleted, ['gone'])
+        self.assertEqual(self._queue(), [])
+        self.assertEqual(self.worker.drain(), 0)
+
+    def test_registry_solr(self):
+        registry = testing.setUp().registry
+        registry.settings['push.solr_uri'] = 'http://solr/'
+        worker = IndexWorker(self.db, batch_size=2, registry=registry)
+        with patch('mysolr.Solr', FakeSolr):
+            self.assertEqual(worker.drain(), 2)
+        self.assertEqual(len(registry.solr.updated), 1)
+
+    def test_solr_error_status_keeps_queue(self):
+        self.solr.update = lambda documents, **kwargs: FakeUpdateResponse(500)
+        self.assertRaises(SolrError, self.worker.drain)
+        self.assertEqual(len(self._queue()), 3)
+
+    def test_solr_delete_error_keeps_queue(self):
+        self.solr.delete_by_query = (
+            lambda query, commit=True: FakeUpdateResponse(503))
+        worker = IndexWorker(self.db, self.solr, batch_size=3)
+        self.assertRaises(SolrError, worker.drain)
+        self.assertEqual(len(self._queue()), 3)
+
+    def test_solr_error_keeps_queue(self):
+        def fail(documents, **kwargs):
+            raise IOError('Solr is down')
+        self.solr.update = fail
+        self.assertRaises(IOError, self.worker.drain)
+        self.assertEqual(len(self._queue()), 3)
+
+
+class TestSolrDocument(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+        item = SharedItem(
+            Title='Foo',
+            Modified=datetime(2013, 1, 2, 3, 4, 5, 600),
+            Subject=['one', 'two'],
+            content=[
+                {'type': 'text/html', 'value': '<p>First</p>'},
+                {'type': 'text/plain', 'value': 'Second'},
+            ],
+        )
+        item.feed_type = ['shared']
+        item.deletion_type = 'selected'
+        self.shared['foo'] = item
+        self.item = item
+
+    def test_fields(self):
+        document = solr_document(self.item)
+        self.assertEqual(document['uid'], 'foo')
+        self.assertEqual(document['Title'], 'Foo')
+        self.assertEqual(document['Modified'], '2013-01-02T03:04:05Z')
+        self.assertEqual(document['Subject'], ['one', 'two'])
+        self.assertEqual(document['feed_type'], ['shared'])
+        self.assertEqual(document['content'], '<p>First</p>')
+
+    def test_no_internal_attributes(self):
+        document = solr_document(self.item)
+        for attr in ('__name__', '__parent__', 'deletion_type',
+                     'sequence', 'Category'):
+            self.assertFalse(attr in document)
+
+    def test_lists_are_copied(self):
+        document = solr_document(self.item)
+        document['feed_type'].append('deleted')
+        self.assertEqual(self.item.feed_type, ('shared', ))
+
+    def test_solr_date(self):
+        offset = tzoffset(None, -4 * 60 * 60)
+        self.assertEqual(
+            solr_date(datetime(2013, 1, 1, 22, tzinfo=offset)),
+            '2013-01-02T02:00:00Z')
+        self.assertEqual(
+            solr_date('2013-01-01T22:00:00-04:00'), '2013-01-02T02:00:00Z')
+
+
+SCHEMA_FIELDS = [
+    {'name': 'uid', 'type': 'string', 'multiValued': False},
+    {'name': 'Title', 'type': 'text_general', 'multiValued': False},
+    {'name': 'Modified', 'type': 'date', 'multiValued': False},
+    {'name': 'feed_type', 'type': 'string', 'multiValued': True},
+]
+SCHEMA_DYNAMIC_FIELDS = [
+    {'name': '*_s', 'type': 'string', 'multiValued': False},
+    {'name': '*', 'type': 'ignored', 'multiValued': True},
+    {'name': 'attr_*', 'type': 'text_general', 'multiValued': True},
+]
+
+
+class TestAtomicDocument(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+        self.shared['foo'] = self.item = SharedItem(
+            Title='Foo', feed_type=['shared'], tile_urls=['a', 'b'],
+            content=[{'type': 'text/html', 'value': '<p>Foo</p>'}])
+        self.item.clear_changes()
+
+    def _document(self):
+        return atomic_document(self.item, self.item.changed_fields())
+
+    def test_unchanged(self):
+        self.assertEqual(self._document(), None)
+
+    def test_sets(self):
+        """Values are added to and removed from the multi valued
+        fields
+        """
+        self.item.add_feed('selected')
+        self.item.tile_urls = ('b', 'c')
+        self.assertEqual(self._document(), {
+            'uid': 'foo',
+            'feed_type': {'add': ['selected']},
+            'tile_urls': {'add': ['c'], 'remove': ['a']},
+        })
+
+    def test_set(self):
+        self.item.Title = 'Bar'
+        self.item.set_content([{'type': 'text/html', 'value': '<p>Bar</p>'}])
+        self.item.Category = 'Site'
+        self.assertEqual(self._document(), {
+            'uid': 'foo',
+            'Title': {'set': 'Bar'},
+            'content': {'set': '<p>Bar</p>'},
+            'Category': {'set': 'Site'},
+        })
+
+    def test_not_indexed(self):
+        self.item.deletion_type = 'selected'
+        self.assertEqual(self._document(), None)
+
+
+class TestSolrSchema(TestCase):
+
+    def setUp(self):
+        self.schema = SolrSchema(SCHEMA_FIELDS, SCHEMA_DYNAMIC_FIELDS[:1])
+
+    def test_unknown_fields_dropped(self):
+        cleaned = self.schema.filter({'uid': 'foo', 'tile_urls': ['a']})
+        self.assertEqual(cleaned, {'uid': 'foo'})
+
+    def test_dynamic_fields(self):
+        schema = SolrSchema(SCHEMA_FIELDS, SCHEMA_DYNAMIC_FIELDS)
+        self.assertEqual(schema.field('Category_s')['type'], 'string')
+        self.assertEqual(schema.field('attr_foo')['type'], 'text_general')
+        self.assertEqual(schema.field('other')['type'], 'ignored')
+        self.assertEqual(self.schema.field('other'), None)
+
+    def test_multi_valued(self):
+        cleaned = self.schema.filter({
+            'uid': ['foo', 'bar'],
+            'feed_type': 'shared',
+            'Title': [],
+        })
+        self.assertEqual(cleaned, {'uid': 'foo', 'feed_type': ['shared']})
+
+    def test_dates(self):
+        cleaned = self.schema.filter({'Modified': datetime(2013, 1, 1)})
+        self.assertEqual(cleaned['Modified'], '2013-01-01T00:00:00Z')
+
+    def test_atomic(self):
+        cleaned = self.schema.filter({
+            'uid': 'foo',
+            'feed_type': {'add': 'selected'},
+            'Title': {'set': []},
+            'Modified': {'set': datetime(2013, 1, 1)},
+        })
+        self.assertEqual(cleaned, {
+            'uid': 'foo',
+            'feed_type': {'add': ['selected']},
+            'Title': {'set': None},
+            'Modified': {'set': '2013-01-01T00:00:00Z'},
+        })
+
+
+class FakeUpdateResponse(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class TestSchemaCache(TestCase):
+
+    def setUp(self):
+        self.fetched = []
+        self.cache = SchemaCache(ttl=60, fetch=self._fetch)
+
+    def _fetch(self, solr):
+        self.fetched.append(solr)
+        return SolrSchema(SCHEMA_FIELDS)
+
+    def test_fetched_once(self):
+        self.cache.get('solr')
+        self.cache.get('solr')
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_expires(self):
+        with patch('time.time', return_value=1000):
+            self.cache.get('solr')
+        with patch('time.time', return_value=1061):
+            self.cache.get('solr')
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_failure_keeps_last_schema(self):
+        schema = self.cache.get('solr')
+        self.cache.fetch = lambda solr: 1 / 0
+        self.cache.invalidate()
+        self.assertTrue(self.cache.get('solr') is schema)
+
+    def test_disabled(self):
+        self.cache.ttl = 0
+        self.assertEqual(self.cache.get('solr'), None)
+        self.assertEqual(self.fetched, [])
+
+    def test_update_documents_filters(self):
+        solr = FakeSolr()
+        with patch('pushhubsearch.indexing.schema_cache', self.cache):
+            update_documents(solr, [{'uid': 'foo', 'unknown': 1}])
+        self.assertEqual(solr.updated, [[{'uid': 'foo'}]])
+
+    def test_update_documents_retries_on_400(self):
+        solr = FakeSolr()
+        statuses = [400, 200]
+
+        def update(documents, **kwargs):
+            solr.updated.append(documents)
+            return FakeUpdateResponse(statuses.pop(0))
+        solr.update = update
+        with patch('pushhubsearch.indexing.schema_cache', self.cache):
+            response = update_documents(solr, [{'uid': 'foo'}])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(solr.updated), 2)
+        self.assertEqual(len(self.fetched), 2)
+
+
+def solr_stand_in(settings):
+    return FakeSolr(settings.get('push.solr_uri'), stand_in=True)
+
+
+class TestMakeSolr(TestCase):
+
+    def test_missing_uri(self):
+        self.assertRaises(AttributeError, make_solr, {})
+
+    def test_settings(self):
+        with patch('mysolr.Solr', FakeSolr):
+            solr = make_solr({
+                'push.solr_uri': 'http://solr/',
+                'push.solr_pool_size': '4',
+                'push.solr_timeout': '2.5',
+                'push.solr_retries': '1',
+            })
+        session = solr.kwargs['make_request']
+        adapter = session.get_adapter('http://solr/')
+        self.assertEqual(session.timeout, 2.5)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 1)
+
+    def test_version(self):
+        with patch('mysolr.Solr', FakeSolr):
+            solr = make_solr({'push.solr_uri': 'http://solr/'})
+            self.assertFalse('version' in solr.kwargs)
+            solr = make_solr({'push.solr_uri': 'http://solr/',
+                              'push.solr_version': '4'})
+        self.assertEqual(solr.kwargs['version'], 4)
+
+    def test_factory(self):
+        solr = make_solr({
+            'push.solr_uri': 'http://solr/',
+            'push.solr_factory':
+                'pushhubsearch.tests.test_indexing.solr_stand_in',
+        })
+        self.assertEqual(solr.solr_uri, 'http://solr/')
+        self.assertTrue(solr.kwargs['stand_in'])
+
+
+class TestUidQuery(TestCase):
+
+    def test_escaped(self):
+        self.assertEqual(uid_query([u'a', u'b"c\\']),
+                         u'uid:("a" OR "b\\"c\\\\")')
+
+    def test_delete_query_is_xml_escaped(self):
+        solr = FakeSolr()
+        delete_documents(solr, [u'a&<b>'])
+        self.assertEqual(solr.deletes, [u'uid:("a&amp;&lt;b&gt;")'])
+        self.assertEqual(solr.commits, 1)
@@ -28,10 +28,31 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import shutil
+import tempfile
+from datetime import datetime
 from unittest import TestCase
 from mock import Mock
+from mock import patch
 
+import transaction
+from BTrees.OOBTree import OOTreeSet
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+
+from pushhubsearch.evolve import evolve_items
+from pushhubsearch.evolve import reindex_items
+from pushhubsearch.feedgen import entry_fragment
+from pushhubsearch.models import IndexQueue
+from pushhubsearch.models import ItemBody
+from pushhubsearch.models import Root
+from pushhubsearch.models import appmaker
+from pushhubsearch.models import merge_sets
+from pushhubsearch.models import normalize_title
+from pushhubsearch.models import smallest_set
 from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
 
 
 class TestFeedTypeAssignment(TestCase):
@@ -128,3 +149,674 @@ class TestEntryUpdateCallsAssignment(TestCase):
             feed_link='shared-content.xml',
             title='Test'
         )
+
+
+class TestFeedIndex(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+
+    def tearDown(self):
+        self.shared = None
+
+    def _add(self, uid, feed_type, day=1):
+        item = SharedItem(Modified=datetime(2013, 1, day))
+        item.feed_type = feed_type
+        self.shared[uid] = item
+        return item
+
+    def _uids(self, feed_name):
+        return [i.__name__ for i in self.shared.feed_items(feed_name)]
+
+    def test_add_indexes_item(self):
+        self._add('foo', ['shared', 'selected'])
+        self.assertEqual(self._uids('shared'), ['foo'])
+        self.assertEqual(self._uids('selected'), ['foo'])
+        self.assertEqual(self._uids('deleted'), [])
+
+    def test_sorted_by_modified(self):
+        self._add('old', ['shared'], day=1)
+        self._add('new', ['shared'], day=3)
+        self._add('mid', ['shared'], day=2)
+        self.assertEqual(self._uids('shared'), ['new', 'mid', 'old'])
+
+    def test_assign_feeds_then_reindex(self):
+        item = self._add('foo', ['shared'])
+        item.assign_feeds(feed_link='atom-selected.xml')
+        item.reindex()
+        self.assertEqual(self._uids('selected'), ['foo'])
+        item.assign_feeds(
+            feed_link='atom-deleted.xml',
+            push_deletion_type='featured',
+        )
+        item.deletion_type = 'featured'
+        item.reindex()
+        self.assertEqual(self._uids('shared'), [])
+        self.assertEqual(self._uids('selected'), [])
+        self.assertEqual(self._uids('deleted'), ['foo'])
+
+    def test_update_from_entry_reindexes_modified(self):
+        self._add('foo', ['shared'], day=1)
+        bar = self._add('bar', ['shared'], day=2)
+        bar.update_from_entry({'updated': '2012-12-31T00:00:00Z'})
+        self.assertEqual(self._uids('shared'), ['foo', 'bar'])
+
+    def test_update_from_entry_reindexes_once(self):
+        item = self._add('foo', ['shared'])
+        with patch('pushhubsearch.models.entry_fragment',
+                   side_effect=entry_fragment) as serialize:
+            item.update_from_entry({
+                'title': u'Foo',
+                'feed_link': 'atom-selected.xml',
+            })
+        self.assertEqual(serialize.call_count, 1)
+        self.assertEqual(self._uids('selected'), ['foo'])
+
+    def test_remove_unindexes(self):
+        self._add('foo', ['shared'])
+        del self.shared['foo']
+        self.assertEqual(self._uids('shared'), [])
+
+    def test_rebuild_indexes(self):
+        self._add('foo', ['shared'])
+        self.shared.clear_indexes()
+        self.assertTrue(self.shared.needs_reindex())
+        self.assertEqual(self.shared._indexes['feed'].get('shared'), None)
+        self.shared.rebuild_indexes()
+        self.assertFalse(self.shared.needs_reindex())
+        self.assertEqual(self._uids('shared'), ['foo'])
+
+    def test_not_indexed(self):
+        """A folder from before the indexes looks at every item until
+        it is reindexed
+        """
+        foo = self._add('foo', ['shared'], day=2)
+        foo.Title = u'Foo'
+        del self.shared._indexes, self.shared._indexed, self.shared._sort_keys
+        del self.shared._fragments, self.shared._indexes_built
+        self.assertTrue(self.shared.needs_reindex())
+        bar = self._add('bar', ['shared', 'selected'])
+        bar.Title = u'Bar'
+        baz = self._add('baz', ['shared'], day=3)
+        baz.Title = u'Foo'
+        del self.shared['baz']
+        self.assertEqual(self._uids('shared'), ['foo', 'bar'])
+        self.assertEqual(self._uids('selected'), ['bar'])
+        self.assertEqual(self.shared.find_by_title(u'Foo'), [foo])
+        self.assertEqual(self.shared.find_by_title_prefix(u''), [bar, foo])
+        self.assertEqual(
+            self.shared.find_by_title_prefix(u'f', limit=1), [foo])
+        self.shared.rebuild_indexes()
+        self.assertEqual(self._uids('shared'), ['foo', 'bar'])
+        self.assertEqual(self.shared.find_by_title_prefix(u''), [bar, foo])
+
+    def test_fragments(self):
+        foo = self._add('foo', ['shared'])
+        self.assertEqual(self.shared.fragment('foo'), entry_fragment(foo))
+        foo.update_from_entry({'title': u'Renamed'})
+        self.assertTrue(b'Renamed' in self.shared.fragment('foo'))
+        self.assertEqual(
+            list(self.shared.feed_fragments('shared')),
+            [entry_fragment(foo)],
+        )
+        del self.shared['foo']
+        self.assertEqual(self.shared.fragment('foo'), None)
+
+    def test_fragments_built_on_reindex(self):
+        self._add('foo', ['shared'])
+        del self.shared._fragments, self.shared._indexes_built
+        self.assertEqual(self.shared.fragment('foo'), None)
+        # The item is used until the fragments are built
+        self.assertEqual(
+            [i.__name__ for i in self.shared.feed_fragments('shared')],
+            ['foo'],
+        )
+        self.assertTrue(self.shared.needs_reindex())
+        self.shared.rebuild_indexes()
+        self.assertTrue(self.shared.fragment('foo'))
+
+    def test_fragment_update(self):
+        """Refreshing an entry only stores the item and its fragment"""
+        for uid in ('foo', 'bar', 'baz'):
+            self._add(uid, ['shared'])
+        db = DB(None)
+        conn = db.open()
+        conn.root()['shared'] = self.shared
+        transaction.commit()
+        conn.cacheMinimize()
+        shared = conn.root()['shared']
+        foo = shared['foo']
+        foo.update_from_entry({'summary': u'New description'})
+        self.assertTrue(b'New description' in shared.fragment('foo'))
+        self.assertEqual(
+            sorted(type(obj).__name__ for obj in conn._registered_objects),
+            ['EntryFragment', 'SharedItem'])
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+class TestTitleIndex(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+        for uid, title, day in (('foo', u'Foo Bar', 1),
+                                ('foo2', u'Foo Bar', 2),
+                                ('folded', u'foo  BAR', 3),
+                                ('other', u'Fool', 4),
+                                ('baz', u'Baz', 5)):
+            self.shared[uid] = SharedItem(
+                Title=title, Modified=datetime(2013, 1, day))
+
+    def tearDown(self):
+        self.shared = None
+
+    def _uids(self, items):
+        return [i.__name__ for i in items]
+
+    def test_exact(self):
+        self.assertEqual(
+            self._uids(self.shared.find_by_title(u'Foo Bar')),
+            ['foo2', 'foo'],
+        )
+        self.assertEqual(self.shared.find_by_title(u'Nothing'), [])
+
+    def test_normalized(self):
+        self.assertEqual(
+            self._uids(self.shared.find_by_title(u'FOO bar',
+                                                 normalized=True)),
+            ['folded', 'foo2', 'foo'],
+        )
+        self.assertEqual(normalize_title(u' Stra\xdfe\n\uff21 '),
+                         normalize_title(u'STRASSE A'))
+
+    def test_prefix(self):
+        self.assertEqual(
+            self._uids(self.shared.find_by_title_prefix(u'fo')),
+            ['folded', 'foo2', 'foo', 'other'],
+        )
+        self.assertEqual(
+            self._uids(self.shared.find_by_title_prefix(u'Foo B',
+                                                        normalized=False)),
+            ['foo2', 'foo'],
+        )
+        self.assertEqual(
+            len(self.shared.find_by_title_prefix(u'fo', limit=2)), 2)
+
+    def test_update_and_delete(self):
+        self.shared['foo'].update_from_entry({'title': u'Renamed'})
+        self.assertEqual(self._uids(self.shared.find_by_title(u'Foo Bar')),
+                         ['foo2'])
+        self.assertEqual(self._uids(self.shared.find_by_title(u'Renamed')),
+                         ['foo'])
+        del self.shared['foo']
+        self.assertEqual(self.shared.find_by_title(u'Renamed'), [])
+        self.assertFalse(u'Renamed' in self.shared._indexes['title'])
+
+    def test_items_not_loaded(self):
+        db = DB(None)
+        conn = db.open()
+        conn.root()['shared'] = self.shared
+        transaction.commit()
+        conn.cacheMinimize()
+        shared = conn.root()['shared']
+        found = shared.find_by_title(u'Baz')
+        self.assertEqual(found[0].Title, u'Baz')
+        self.assertEqual(shared.data['foo']._p_changed, None)
+        transaction.abort()
+        conn.close()
+        db.close()
+
+
+class TestTileIndex(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+        for uid, day in (('foo', 1), ('bar', 2)):
+            item = SharedItem(Modified=datetime(2013, 1, day))
+            item.feed_type = ['shared']
+            self.shared[uid] = item
+
+    def tearDown(self):
+        self.shared = None
+
+    def _uids(self, tile_url, removed=False):
+        return [i.__name__ for i in self.shared.tile_items(tile_url, removed)]
+
+    def test_update_from_entry(self):
+        self.shared['foo'].update_from_entry(
+            {'push_tile_urls': 'http://a/tile1|http://a/tile2'})
+        self.shared['bar'].update_from_entry(
+            {'push_tile_urls': 'http://a/tile1'})
+        self.assertEqual(self._uids('http://a/tile1'), ['bar', 'foo'])
+        self.assertEqual(self._uids('http://a/tile2'), ['foo'])
+        self.shared['foo'].update_from_entry(
+            {'push_deleted_tile_urls': 'http://a/tile1'})
+        self.assertEqual(self._uids('http://a/tile1'), ['bar'])
+        self.assertEqual(self._uids('http://a/tile1', removed=True), ['foo'])
+        del self.shared['bar']
+        self.assertEqual(self._uids('http://a/tile1'), [])
+
+
+class TestFieldIndexes(TestCase):
+
+    def setUp(self):
+        self.shared = SharedItems()
+        for uid, day, portal_type, subjects in (
+                ('doc', 1, u'Document', [u'a', u'b']),
+                ('event', 2, u'Event', [u'a']),
+                ('news', 3, u'News Item', [])):
+            item = SharedItem(Modified=datetime(2013, 1, day),
+                              portal_type=portal_type, Subject=subjects,
+                              Category=u'Site')
+            item.feed_type = ['shared']
+            self.shared[uid] = item
+
+    def tearDown(self):
+        self.shared = None
+
+    def _uids(self, *filters):
+        return [k[1] for k in self.shared.feed_keys('shared', filters)]
+
+    def test_filters(self):
+        self.assertEqual(self._uids(), ['news', 'event', 'doc'])
+        self.assertEqual(self._uids(('Category', u'Site')),
+                         ['news', 'event', 'doc'])
+        self.assertEqual(self._uids(('Subject', u'a')), ['event', 'doc'])
+        self.assertEqual(
+            self._uids(('Subject', u'a'), ('portal_type', u'Document')),
+            ['doc'])
+        self.assertEqual(self._uids(('Subject', u'x')), [])
+        self.assertEqual(self.shared.feed_count(
+            'shared', [('Subject', u'b')]), 1)
+
+    def test_update(self):
+        self.shared['news'].update_from_entry(
+            {'tags': [{'term': u'a'}]})
+        self.assertEqual(self._uids(('Subject', u'a')),
+                         ['news', 'event', 'doc'])
+
+    def test_no_empty_values(self):
+        self.shared['blank'] = SharedItem()
+        self.assertFalse(None in self.shared._indexes['Category'])
+        self.assertFalse(u'' in self.shared._indexes['Creator'])
+
+    def test_smallest_set(self):
+        sets = [OOTreeSet(range(10)), OOTreeSet(range(3)),
+                OOTreeSet(range(5))]
+        self.assertTrue(smallest_set(sets) is sets[1])
+
+
+class TestIndexQueue(TestCase):
+
+    def test_coalesce(self):
+        queue = IndexQueue()
+        self.assertFalse(queue)
+        queue.index('foo')
+        queue.index('foo')
+        queue.index('bar')
+        queue.unindex('bar')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.peek(10), [('bar', 'delete'), ('foo', 'index')])
+
+    def test_done(self):
+        queue = IndexQueue()
+        queue.index('foo')
+        queue.index('bar')
+        batch = queue.peek(1)
+        queue.done(batch)
+        self.assertEqual(queue.peek(10), [('foo', 'index')])
+
+    def test_done_keeps_newer_operation(self):
+        queue = IndexQueue()
+        queue.index('foo')
+        batch = queue.peek(1)
+        queue.unindex('foo')
+        queue.done(batch)
+        self.assertEqual(queue.peek(10), [('foo', 'delete')])
+
+
+class TestConflictResolution(TestCase):
+
+    def setUp(self):
+        # MappingStorage doesn't resolve conflicts, FileStorage does
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage('%s/Data.fs' % self.tempdir))
+        conn = self.db.open()
+        conn.root()['shared'] = shared = SharedItems()
+        # Other items, so that the index sets aren't all emptied
+        for uid in ('bar', 'baz'):
+            shared[uid] = SharedItem(
+                Title=uid, feed_type=['shared', 'selected'], tile_urls=['x'])
+        shared['item'] = SharedItem(
+            Title='Foo', feed_type=['shared'], tile_urls=['x', 'y'])
+        transaction.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def _open(self):
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager=tm)
+        return tm, conn.root()['shared']['item']
+
+    def test_merge_sets(self):
+        self.assertEqual(
+            merge_sets(['a', 'b', 'c'], ['a', 'c', 'd'], ['b', 'c', 'e']),
+            ['c', 'd', 'e'],
+        )
+
+    def test_feed_and_tile(self):
+        """Selecting an item and placing it on a tile at the same time"""
+        tm1, item1 = self._open()
+        tm2, item2 = self._open()
+        item1.update_from_entry({'feed_link': 'selected-content.xml'})
+        item2.update_from_entry({'push_tile_urls': 'z'})
+        tm1.commit()
+        tm2.commit()
+        tm, item = self._open()
+        shared = item.__parent__
+        self.assertEqual(item.feed_type, ('shared', 'selected'))
+        self.assertEqual(sorted(item.tile_urls), ['x', 'y', 'z'])
+        self.assertEqual(
+            [i.__name__ for i in shared.feed_items('selected')],
+            ['item', 'baz', 'bar'])
+        self.assertEqual(
+            [i.__name__ for i in shared.tile_items('z')], ['item'])
+        self.assertTrue(b'|z' in shared.fragment('item') or
+                        b'z|' in shared.fragment('item'))
+        tm.abort()
+
+    def test_set_attributes(self):
+        """Concurrent changes to the tiles and feeds are merged"""
+        tm1, item1 = self._open()
+        tm2, item2 = self._open()
+        item1.update_from_entry({'push_tile_urls': 'a',
+                                 'feed_link': 'selected-content.xml'})
+        item2.update_from_entry({'push_tile_urls': 'b',
+                                 'summary': 'Changed'})
+        tm1.commit()
+        tm2.commit()
+        tm, item = self._open()
+        shared = item.__parent__
+        self.assertEqual(sorted(item.tile_urls), ['a', 'b', 'x', 'y'])
+        self.assertEqual(item.feed_type, ('shared', 'selected'))
+        self.assertEqual(item.Description, 'Changed')
+        self.assertEqual(item.Title, 'Foo')
+        for tile in ('a', 'b'):
+            self.assertEqual(
+                [i.__name__ for i in shared.tile_items(tile)], ['item'])
+        # Both refreshed the entry, the merged item is used instead
+        self.assertEqual(shared.fragment('item'), None)
+        self.assertEqual(
+            list(shared.fragments_of([(None, 'item')])), [item])
+        item.reindex()
+        self.assertTrue(b'Changed' in shared.fragment('item'))
+        tm.abort()
+
+    def test_same_attribute(self):
+        tm1, item1 = self._open()
+        tm2, item2 = self._open()
+        item1.update_from_entry({'title': 'Bar'})
+        item2.update_from_entry({'title': 'Baz'})
+        tm1.commit()
+        self.assertRaises(ConflictError, tm2.commit)
+        tm2.abort()
+
+
+
+class TestConcurrentSequence(TestCase):
+
+    def setUp(self):
+        # MappingStorage doesn't resolve conflicts, FileStorage does
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage('%s/Data.fs' % self.tempdir))
+        conn = self.db.open()
+        root = appmaker(conn.root())
+        for uid in ('a', 'b'):
+            root.shared[uid] = SharedItem(Title=uid)
+        transaction.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def _open(self):
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager=tm)
+        return tm, conn.root()['app_root']
+
+    def test_poll_between_commits(self):
+        """A change committed after a poll is stamped after it"""
+        tm1, root1 = self._open()
+        tm2, root2 = self._open()
+        root1.record_change('a')
+        root2.record_change('b')
+        tm1.commit()
+        tm, root = self._open()
+        self.assertEqual(
+            [change[:2] for change in root.shared.changes()], [(1, 'a')])
+        tm.abort()
+        # The sequence numbers are handed out one commit at a time, the
+        # second push is retried like pyramid_tm does
+        self.assertRaises(ConflictError, tm2.commit)
+        tm2.abort()
+        root2.record_change('b')
+        tm2.commit()
+        tm, root = self._open()
+        self.assertEqual(
+            [change[:2] for change in root.shared.changes(1)], [(2, 'b')])
+        tm.abort()
+
+LEGACY_STATE = {
+    'Title': u'Foo',
+    'feed_type': ['shared', 'deleted'],
+    'Subject': ['one', 'two'],
+    'tile_urls': ['http://example.com/tile'],
+    'deleted_tile_urls': [],
+    'content': [{'type': 'text/html', 'language': None,
+                 'base': 'http://example.com', 'value': '<p>Foo</p>'}],
+}
+
+
+class TestCompactState(TestCase):
+
+    def test_feed_type(self):
+        item = SharedItem(feed_type=['deleted', 'shared'])
+        self.assertEqual(item.feed_type, ('shared', 'deleted'))
+        item.add_feed('selected')
+        item.remove_feed('deleted')
+        self.assertEqual(item.feed_type, ('shared', 'selected'))
+        self.assertEqual(item.__getstate__()['_feeds'], 3)
+        self.assertRaises(ValueError, item.add_feed, 'featured')
+
+    def test_legacy_state(self):
+        item = SharedItem.__new__(SharedItem)
+        item.__setstate__(LEGACY_STATE)
+        self.assertEqual(item.feed_type, ('shared', 'deleted'))
+        self.assertEqual(item.Subject, ('one', 'two'))
+        self.assertEqual(item.deleted_tile_urls, ())
+        self.assertEqual(item.content, [{
+            'type': 'text/html', 'base': 'http://example.com',
+            'value': '<p>Foo</p>'}])
+        state = item.__getstate__()
+        self.assertFalse('feed_type' in state)
+        self.assertFalse('content' in state)
+
+    def test_evolve(self):
+        db = DB(None)
+        conn = db.open()
+        conn.root()['shared'] = shared = SharedItems()
+        with patch.object(SharedItem, '__getstate__',
+                          lambda self: LEGACY_STATE):
+            shared['foo'] = SharedItem()
+            transaction.commit()
+        oid = shared['foo']._p_oid
+        self.assertTrue(b'feed_type' in db.storage.load(oid, '')[0])
+        # Load the item from the storage again
+        conn.cacheMinimize()
+        conn.close()
+        conn = db.open()
+        try:
+            self.assertEqual(evolve_items(conn.root()['shared']), 1)
+            record = db.storage.load(oid, '')[0]
+            self.assertFalse(b'feed_type' in record)
+            self.assertFalse(b'<p>Foo</p>' in record)
+            item = conn.root()['shared']['foo']
+            self.assertEqual(item.feed_type, ('shared', 'deleted'))
+            self.assertEqual(item.content[0]['value'], '<p>Foo</p>')
+        finally:
+            transaction.abort()
+            conn.close()
+            db.close()
+
+
+class TestReindexItems(TestCase):
+
+    def setUp(self):
+        self.db = DB(None)
+        conn = self.db.open()
+        conn.root()['shared'] = shared = SharedItems()
+        for day in range(1, 6):
+            shared['item-%s' % day] = SharedItem(
+                Modified=datetime(2013, 1, day), feed_type=['shared'])
+        del shared._indexes, shared._indexed, shared._sort_keys
+        del shared._fragments, shared._indexes_built
+        transaction.commit()
+        conn.close()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+
+    def test_reindex(self):
+        conn = self.db.open()
+        shared = conn.root()['shared']
+        with patch('transaction.commit', wraps=transaction.commit) as commit:
+            self.assertEqual(reindex_items(shared, batch_size=2), 5)
+        # Once for clearing, for each batch and for the end
+        self.assertEqual(commit.call_count, 5)
+        self.assertFalse(shared.needs_reindex())
+        self.assertEqual(
+            [i.__name__ for i in shared.feed_items('shared')],
+            ['item-5', 'item-4', 'item-3', 'item-2', 'item-1'])
+        self.assertTrue(shared.fragment('item-1'))
+        conn.close()
+
+    def test_appmaker_leaves_indexes(self):
+        conn = self.db.open()
+        root = conn.root()
+        root['app_root'] = Root()
+        root['app_root'].shared = root['shared']
+        with patch('pushhubsearch.models.logger') as logger:
+            shared = appmaker(root).shared
+        self.assertTrue(logger.warning.called)
+        self.assertTrue(shared.needs_reindex())
+        self.assertEqual(len(list(shared.feed_items('shared'))), 5)
+        transaction.abort()
+        conn.close()
+
+
+class TestItemBody(TestCase):
+
+    def setUp(self):
+        self.db = DB(None)
+        conn = self.db.open()
+        conn.root()['item'] = SharedItem(
+            Title=u'Foo',
+            content=[{'type': 'text/html', 'value': '<p>Foo</p>'}])
+        transaction.commit()
+        conn.close()
+
+    def tearDown(self):
+        transaction.abort()
+        self.db.close()
+
+    def _load(self):
+        conn = self.db.open()
+        conn.cacheMinimize()
+        return conn.root()['item']
+
+    def test_lazy(self):
+        """The content is only loaded when it is used"""
+        item = self._load()
+        self.assertEqual(item.Title, u'Foo')
+        self.assertTrue(isinstance(item._body, ItemBody))
+        self.assertEqual(item._body._p_status, 'ghost')
+        self.assertEqual(
+            item.content, [{'type': 'text/html', 'value': '<p>Foo</p>'}])
+        self.assertEqual(item._body._p_status, 'saved')
+
+    def test_update(self):
+        """Changing the content only stores the body"""
+        item = self._load()
+        item.set_content([{'type': 'text/html', 'value': '<p>Bar</p>'}])
+        self.assertFalse(item._p_changed)
+        self.assertTrue(item._body._p_changed)
+        transaction.commit()
+        self.assertEqual(self._load().content[0]['value'], '<p>Bar</p>')
+
+    def test_no_content(self):
+        self.assertEqual(SharedItem()._body, None)
+        self.assertEqual(SharedItem().content, [])
+
+
+class TestChangeTracking(TestCase):
+
+    def setUp(self):
+        self.item = SharedItem(
+            Title=u'Foo', Description=u'Old', feed_type=['shared'],
+            content=[{'type': 'text/html', 'value': '<p>Foo</p>'}])
+        self.item.clear_changes()
+
+    def test_defaults_not_shared(self):
+        tiles = ['http://example.com/tile']
+        first = SharedItem(tile_urls=tiles)
+        tiles.append('http://example.com/other')
+        self.assertEqual(first.tile_urls, ('http://example.com/tile', ))
+        self.assertEqual(SharedItem().tile_urls, ())
+
+    def test_new_item(self):
+        changes = SharedItem(Title=u'Foo').changed_fields()
+        self.assertEqual(changes['Title'], None)
+        self.assertFalse('content' in changes)
+
+    def test_update_from_entry(self):
+        """Only the fields with a new value are noted"""
+        self.item.update_from_entry({
+            'title': u'Foo',
+            'summary': u'New',
+            'content': [{'type': 'text/html', 'value': '<p>Foo</p>'}],
+        })
+        self.assertEqual(self.item.changed_fields(), {'Description': u'Old'})
+
+    def test_first_value_kept(self):
+        self.item.Title = u'Bar'
+        self.item.Title = u'Baz'
+        self.assertEqual(self.item.changed_fields(), {'Title': u'Foo'})
+
+    def test_feeds_and_content(self):
+        self.item.add_feed('shared')
+        self.assertEqual(self.item.changed_fields(), {})
+        self.item.add_feed('selected')
+        self.item.set_content([{'type': 'text/html', 'value': '<p>Bar</p>'}])
+        self.assertEqual(self.item.changed_fields(), {
+            'feed_type': ('shared', ),
+            'content': [{'type': 'text/html', 'value': '<p>Foo</p>'}],
+        })
+
+    def test_deletion_type(self):
+        self.assertFalse(hasattr(self.item, 'deletion_type'))
+        self.item.deletion_type = 'selected'
+        del self.item.deletion_type
+        self.assertFalse(hasattr(self.item, 'deletion_type'))
+        self.assertEqual(
+            self.item.changed_fields(), {'deletion_type': None})
+
+    def test_clear_changes(self):
+        self.item.Title = u'Bar'
+        self.item.clear_changes()
+        self.assertEqual(self.item.changed_fields(), {})
@@ -0,0 +1,131 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from unittest import TestCase
+
+from pushhubsearch.parser import feedparser_entries
+from pushhubsearch.parser import iterparse_entries
+from pushhubsearch.parser import parse_entries
+from pushhubsearch.parser import UnsupportedFeed
+
+FEED = b"""\
+<?xml version="1.0" encoding="utf-8" ?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:push="http://ucla.edu/#portal-pool"
+      xmlns:dc="http://purl.org/dc/elements/1.1/"
+      xml:base="http://example.com"
+      xml:lang="en">
+  <link rel="hub" href="http://example.com/hub" />
+  <link rel="self" href="http://example.com/shared-content.xml" />
+  <title type="html">Example Site</title>
+  <link rel="alternate" type="text/html"
+        href="http://example.com/shared-content.xml" />
+  <id>urn:syndication:site</id>
+%s
+</feed>"""
+ENTRY = b"""\
+  <entry>
+    <title>Foo &amp; Bar</title>
+    <link rel="alternate" type="text/html" href="%(uid)s" />
+    <id> urn:syndication:%(uid)s </id>
+    <updated>2013-01-01T00:00:00Z</updated>
+    <summary>Summary of &lt;b&gt;Foo&lt;/b&gt;</summary>
+    <content type="html">Body of &lt;p&gt;Foo&lt;/p&gt;</content>
+    <author><name>Jane</name></author>
+    <category term="Example Site" label="Site Title" />
+    <category term="news" scheme="http://example.com/tags" />
+    <dc:subject>events</dc:subject>
+    <push:portal_type>Document</push:portal_type>
+    <push:tile_urls>http://example.com/a|http://example.com/b</push:tile_urls>
+    <push:deleted_tile_urls></push:deleted_tile_urls>
+  </entry>"""
+XHTML_ENTRY = b"""\
+  <entry>
+    <title>Xhtml</title>
+    <id>urn:syndication:%(uid)s</id>
+    <content type="xhtml">
+      <div xmlns="http://www.w3.org/1999/xhtml"><p>Body</p></div>
+    </content>
+  </entry>"""
+
+
+def feed(*entries):
+    return FEED % b''.join(e % {b'uid': uid} for e, uid in entries)
+
+
+class TestIterparseEntries(TestCase):
+
+    def test_matches_feedparser(self):
+        """The fields we use come out as feedparser has them"""
+        body = feed((ENTRY, b'foo'), (ENTRY, b'bar'))
+        fast = list(iterparse_entries(body))
+        slow = list(feedparser_entries(body))
+        self.assertEqual(len(fast), 2)
+        for fast_entry, slow_entry in zip(fast, slow):
+            for key, value in fast_entry.items():
+                self.assertEqual(value, slow_entry[key], key)
+        self.assertEqual(fast[1]['link'], 'http://example.com/bar')
+        self.assertEqual(
+            fast[0]['feed_link'], 'http://example.com/shared-content.xml')
+
+    def test_not_atom(self):
+        body = b'<rss version="2.0"><channel></channel></rss>'
+        self.assertRaises(UnsupportedFeed, list, iterparse_entries(body))
+
+    def test_xhtml(self):
+        body = feed((XHTML_ENTRY, b'foo'))
+        self.assertRaises(UnsupportedFeed, list, iterparse_entries(body))
+
+
+class TestParseEntries(TestCase):
+
+    def test_fast(self):
+        entries = list(parse_entries(feed((ENTRY, b'foo')), fast=True))
+        self.assertTrue(isinstance(entries[0], dict))
+        self.assertEqual(entries[0]['push_portal_type'], 'Document')
+
+    def test_fallback(self):
+        """Entries after the one the fast parser chokes on come from
+        feedparser, without repeating the ones already parsed.
+        """
+        body = feed((ENTRY, b'foo'), (XHTML_ENTRY, b'bar'), (ENTRY, b'baz'))
+        entries = list(parse_entries(body, fast=True))
+        self.assertEqual(
+            [e['id'] for e in entries],
+            ['urn:syndication:foo', 'urn:syndication:bar',
+             'urn:syndication:baz'],
+        )
+        self.assertEqual(
+            entries[1]['content'][0]['type'], 'application/xhtml+xml')
+
+    def test_malformed(self):
+        body = feed((ENTRY, b'foo')).replace(b'</feed>', b'')
+        entries = list(parse_entries(body, fast=True))
+        self.assertEqual([e['id'] for e in entries], ['urn:syndication:foo'])
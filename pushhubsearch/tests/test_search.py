@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from unittest import TestCase
+from mock import patch
+
+from pushhubsearch.indexing import solr_generation
+from pushhubsearch.search import Search
+from pushhubsearch.search import SearchCache
+
+
+class TestParse(TestCase):
+
+    def test_terms(self):
+        query = Search.parse(
+            u'budget "board meeting" category:"School of Law" '
+            u'subject:news feed:selected type:Event')
+        self.assertEqual(query.text, (u'budget', u'board meeting'))
+        self.assertEqual(query.filters, (
+            ('Category', u'School of Law'),
+            ('Subject', u'news'),
+            ('feed_type', u'selected'),
+            ('portal_type', u'Event'),
+        ))
+
+    def test_unknown_name_is_text(self):
+        query = Search.parse(u'http://example.com/page')
+        self.assertEqual(query.text, (u'http://example.com/page', ))
+        self.assertEqual(query.filters, ())
+
+    def test_dates(self):
+        query = Search.parse(u'modified:2013-01-01..2013-02-01T12:00')
+        self.assertEqual(query.modified,
+                         ('2013-01-01T00:00:00Z', '2013-02-01T12:00:00Z'))
+        query = Search.parse(u'modified:2013-01-01..')
+        self.assertEqual(query.modified, ('2013-01-01T00:00:00Z', None))
+        self.assertRaises(ValueError, Search.parse, u'modified:soon')
+
+    def test_key(self):
+        self.assertEqual(
+            Search.parse(u'b a  subject:x "a"').key(),
+            Search.parse(u'subject:"x" a b').key(),
+        )
+        self.assertNotEqual(
+            Search.parse(u'a subject:x').key(),
+            Search.parse(u'a subject:y').key(),
+        )
+        self.assertEqual(
+            Search.parse(u'modified:2013-01-01..').key(),
+            Search.parse(u'modified:"2013-01-01T00:00:00Z.."').key(),
+        )
+
+
+class TestSolrParams(TestCase):
+
+    def test_text(self):
+        params = Search.parse(u'budget say"hi').solr_params(10)
+        self.assertEqual(params['q'], u'"budget" AND "say\\"hi"')
+        self.assertEqual(params['rows'], 10)
+        self.assertEqual(params['fl'], 'uid')
+        self.assertTrue(params['sort'].startswith('score desc'))
+        self.assertFalse('fq' in params)
+
+    def test_text_fields(self):
+        params = Search.parse(u'budget').solr_params(10, 'Title^2 content')
+        self.assertEqual(params['defType'], 'edismax')
+        self.assertEqual(params['qf'], 'Title^2 content')
+
+    def test_filters(self):
+        params = Search.parse(
+            u'category:"My Site" modified:..2013-02-01').solr_params(5)
+        self.assertEqual(params['q'], '*:*')
+        self.assertEqual(params['sort'], 'Modified desc')
+        self.assertEqual(params['fq'], [
+            u'Category:"My Site"',
+            u'Modified:[* TO 2013-02-01T00:00:00Z]',
+        ])
+
+
+class TestSearchCache(TestCase):
+
+    def test_invalidated_by_writes(self):
+        cache = SearchCache()
+        cache.set('key', ['a'], solr_generation.value)
+        self.assertEqual(cache.get('key'), ['a'])
+        solr_generation.bump()
+        self.assertEqual(cache.get('key'), None)
+
+    def test_stale_generation(self):
+        cache = SearchCache()
+        generation = solr_generation.value
+        solr_generation.bump()
+        cache.set('key', ['a'], generation)
+        self.assertEqual(cache.get('key'), None)
+
+    def test_ttl(self):
+        cache = SearchCache(ttl=10)
+        with patch('time.time', return_value=100):
+            cache.set('key', ['a'], solr_generation.value)
+        with patch('time.time', return_value=105):
+            self.assertEqual(cache.get('key'), ['a'])
+        with patch('time.time', return_value=111):
+            self.assertEqual(cache.get('key'), None)
@@ -0,0 +1,191 @@
+"""
+Copyright (c) 2013, Regents of the University of California
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+  * Redistributions of source code must retain the above copyright notice,
+    this list of conditions and the following disclaimer.
+
+  * Redistributions in binary form must reproduce the above copyright notice,
+    this list of conditions and the following disclaimer in the documentation
+    and/or other materials provided with the distribution.
+
+  * Neither the name of the University of California nor the names of its
+    contributors may be used to endorse or promote products derived from this
+    software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from unittest import TestCase
+from pyramid import testing
+from pyramid.request import Request
+from mock import patch
+
+import transaction
+from ZODB import DB
+
+from pushhubsearch.models import appmaker
+from pushhubsearch.models import Root
+from pushhubsearch.models import SharedItem
+from pushhubsearch.models import SharedItems
+from pushhubsearch.snapshot import SnapshotWriter
+from pushhubsearch.snapshot import write_atomically
+from pushhubsearch.snapshot import write_snapshots
+from pushhubsearch.snapshot import snapshot_request
+from pushhubsearch.views import global_shared
+
+
+def add_routes(config):
+    config.add_route('shared', '/global-shared.xml')
+    config.add_route('selected', '/global-selected.xml')
+    config.add_route('deleted', '/global-deletions.xml')
+
+
+def add_items(shared):
+    for day in range(1, 4):
+        item = SharedItem(Title='Item %s' % day,
+                          Modified=datetime(2013, 1, day))
+        item.feed_type = ['shared']
+        shared['item%s' % day] = item
+
+
+class TestWriteSnapshots(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        add_routes(self.config)
+        self.root = Root()
+        self.root.shared = SharedItems()
+        add_items(self.root.shared)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        testing.tearDown()
+        self.root = None
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def test_feeds(self):
+        request = snapshot_request(self.config.registry)
+        paths = write_snapshots(self.root, self.directory, request)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            ['global-deletions.xml', 'global-selected.xml',
+             'global-shared.xml'],
+        )
+        self.assertEqual(len(paths), 3)
+        request = Request.blank('/global-shared.xml')
+        request.registry = self.config.registry
+        self.assertEqual(
+            self._read('global-shared.xml'),
+            global_shared(self.root, request).body,
+        )
+        self.assertFalse(b'Item 1' in self._read('global-selected.xml'))
+
+    def test_snapshot_url(self):
+        self.config.registry.settings['push.snapshot_url'] = \
+            'http://example.com/hub'
+        request = snapshot_request(self.config.registry)
+        write_snapshots(self.root, self.directory, request)
+        self.assertTrue(b'http://example.com/hub/global-shared.xml' in
+                        self._read('global-shared.xml'))
+
+    def test_replace(self):
+        path = os.path.join(self.directory, 'feed.xml')
+        write_atomically(path, [b'old'])
+        write_atomically(path, [b'new', b' feed'])
+        self.assertEqual(self._read('feed.xml'), b'new feed')
+        self.assertEqual(os.listdir(self.directory), ['feed.xml'])
+
+    def test_failed_write(self):
+        path = os.path.join(self.directory, 'feed.xml')
+        write_atomically(path, [b'old'])
+
+        def chunks():
+            yield b'partial'
+            raise ValueError('broken')
+
+        self.assertRaises(ValueError, write_atomically, path, chunks())
+        self.assertEqual(self._read('feed.xml'), b'old')
+        self.assertEqual(os.listdir(self.directory), ['feed.xml'])
+
+
+class TestSnapshotWriter(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        add_routes(self.config)
+        self.db = DB(None)
+        conn = self.db.open()
+        add_items(appmaker(conn.root()).shared)
+        transaction.commit()
+        conn.close()
+        self.directory = tempfile.mkdtemp()
+        self.writer = SnapshotWriter(
+            self.db, self.config.registry, self.directory, delay=0.05)
+
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.directory)
+        self.db.close()
+        testing.tearDown()
+
+    def test_write(self):
+        paths = self.writer.write()
+        self.assertEqual(len(paths), 3)
+        with open(os.path.join(self.directory, 'global-shared.xml')) as f:
+            self.assertTrue('Item 3' in f.read())
+
+    def test_debounce(self):
+        written = threading.Event()
+        calls = []
+
+        def write():
+            calls.append(1)
+            written.set()
+
+        with patch.object(self.writer, 'write', write):
+            self.writer.start()
+            for i in range(5):
+                self.writer.schedule()
+            self.assertTrue(written.wait(5))
+            self.writer.stop()
+            self.writer.join(5)
+        self.assertEqual(calls, [1])
+
+    def test_schedule_on_commit(self):
+        tm = transaction.TransactionManager()
+        txn = tm.begin()
+        self.writer.schedule_on_commit(txn)
+        self.writer.schedule_on_commit(txn)
+        self.assertEqual(len(list(txn.getAfterCommitHooks())), 1)
+        self.assertFalse(self.writer._changed.is_set())
+        tm.commit()
+        self.assertTrue(self.writer._changed.is_set())
+
+    def test_not_scheduled_on_abort(self):
+        tm = transaction.TransactionManager()
+        txn = tm.begin()
+        self.writer.schedule_on_commit(txn)
+        tm.abort()
+        self.assertFalse(self.writer._changed.is_set())
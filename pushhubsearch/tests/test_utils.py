@@ -34,6 +34,7 @@ from pyramid import testing
 
 from pushhubsearch.models import Root, SharedItems, SharedItem
 from pushhubsearch.utils import remove_deleted_status
+from pushhubsearch.utils import remove_deleted_statuses
 from .test_views import FakeSolr
 
 
@@ -78,3 +79,33 @@ class TestNotDeletedStatus(TestRemovalBase):
         remove_deleted_status('uuuuid', self.root.shared, self.solr)
         self.assertTrue('shared' in self.item.feed_type)
         self.assertTrue('selected' in self.item.feed_type)
+
+
+class TestRemoveDeletedStatuses(TestRemovalBase):
+    def setUp(self):
+        super(TestRemoveDeletedStatuses, self).setUp()
+        remote = SharedItem()
+        remote.feed_type = ['shared', 'deleted']
+        self.solr.catalog['remote'] = [remote]
+
+    def test_local_items_not_searched(self):
+        documents = remove_deleted_statuses(
+            ['uuuuid'], self.root.shared, self.solr)
+        self.assertEqual(self.solr.searches, [])
+        self.assertEqual(documents[0]['uid'], 'uuuuid')
+        self.assertEqual(documents[0]['feed_type'], ['selected'])
+
+    def test_remote_items_single_query(self):
+        documents = remove_deleted_statuses(
+            ['uuuuid', 'remote', 'missing'], self.root.shared, self.solr)
+        self.assertEqual(len(self.solr.searches), 1)
+        self.assertEqual(
+            [(d['uid'], d['feed_type']) for d in documents],
+            [('uuuuid', ['selected']), ('remote', ['shared'])],
+        )
+        self.assertEqual(self.solr.updated, [])
+
+    def test_remove_deleted_status_updates_solr(self):
+        remove_deleted_status('remote', self.root.shared, self.solr)
+        self.assertEqual(
+            self.solr.updated, [[{'uid': 'remote', 'feed_type': ['shared']}]])
@@ -28,14 +28,33 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import re
+import shutil
+import tempfile
+import threading
+from datetime import datetime
 from unittest import TestCase
 from pyramid import testing
+from pyramid.request import Request
+from mock import Mock
 from mock import patch
+import transaction
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.POSException import ConflictError
+from pushhubsearch.indexing import update_documents
 from pushhubsearch.models import Root
+from pushhubsearch.models import appmaker
 from pushhubsearch.models import SharedItems
 from pushhubsearch.models import SharedItem
+from pushhubsearch.views import UpdateItems
+from pushhubsearch.views import changes_feed
 from pushhubsearch.views import delete_items
 from pushhubsearch.views import combine_entries
+from pushhubsearch.views import global_shared
+from pushhubsearch.views import stream_feed
+from pushhubsearch.views import tile_feed
+from pushhubsearch.views import search
 
 XML_WRAPPER = """\
 <?xml version="1.0" encoding="utf-8" ?>
@@ -64,37 +83,78 @@ XML_ENTRY = """\
   </entry>"""
 
 
+SHARED_WRAPPER = XML_WRAPPER.replace(
+    '<link rel="alternate" type="text/html" href="http://example.com" />',
+    '<link rel="alternate" type="text/html" '
+    'href="http://example.com/shared-content.xml" />',
+)
+FULL_ENTRY = """\
+  <entry>
+    <title>%(title)s</title>
+    <link rel="alternate" type="text/html" href="http://example.com/%(uid)s" />
+    <id>urn:syndication:%(uid)s</id>
+    <updated>%(updated)s</updated>
+    <summary>Summary of %(title)s</summary>
+    <content type="html">Body of %(title)s</content>
+  </entry>"""
+
+
+def shared_feed(*entries):
+    """Build a shared feed from (uid, title, updated) tuples"""
+    return SHARED_WRAPPER % "".join(
+        FULL_ENTRY % {'uid': uid, 'title': title, 'updated': updated}
+        for uid, title, updated in entries
+    )
+
+
 class FakeResponse(object):
     def __init__(self, documents=None):
         self.documents = documents
 
 class FakeSolr(object):
 
-    def __init__(self, solr_uri=None):
+    def __init__(self, solr_uri=None, **kwargs):
         self.solr_uri = solr_uri
+        self.kwargs = kwargs
         self.deleted = []
+        self.updated = []
+        self.searches = []
         self.catalog = {}
+        self.deletes = []
+        self.commits = 0
 
     def delete_by_key(self, key):
         self.deleted.append(key)
 
+    def delete_by_query(self, query, commit=True):
+        self.deletes.append(query)
+        self.deleted.extend(re.findall(r'"([^"]+)"', query))
+        if commit:
+            self.commit()
+
+    def commit(self, **kwargs):
+        self.commits += 1
+
     def search(self, **kwargs):
         query = kwargs.get('q', None)
         if not query:
             return
-        else:
-            uid = query.split(':')[1]
-            uid = uid.replace('"', '')
-            docs = self.catalog.get(uid)
-            new_docs = []
-            for doc in docs:
-                new_docs.append({'feed_type': doc.feed_type,
+        self.searches.append(query)
+        new_docs = []
+        for uid in re.findall(r'"([^"]+)"', query):
+            for doc in self.catalog.get(uid, []):
+                new_docs.append({'feed_type': list(doc.feed_type),
                                  'uid': uid
                                 })
-            return FakeResponse(documents=new_docs)
+        return FakeResponse(documents=new_docs)
 
     def update(self, documents, **kwargs):
-        pass
+        self.updated.append(documents)
+
+
+def without_timings(text):
+    """Mask the Solr timings reported by `delete_items`"""
+    return re.sub(r'\d+\.\d+s', 'Xs', text)
 
 
 class TestDeletion(TestCase):
@@ -134,10 +194,12 @@ class TestDeletion(TestCase):
         response = delete_items(self.root, request)
         patcher.stop()
         self.assertEquals(
-            response.body,
+            without_timings(response.text),
             'Removed 0 items. 1 items could not be found for deletion: 1'
+            ' Removed 1 uids from Solr in 1 batches: 1 in Xs.'
         )
         self.assertEquals(response.code, 200)
+        self.assertEqual(self.root.sequence, 0)
 
     def test_removal(self):
         """When an item is present in the feed, it will be deleted
@@ -155,9 +217,14 @@ class TestDeletion(TestCase):
         patcher.start()
         response = delete_items(self.root, request)
         patcher.stop()
-        self.assertEquals(response.body, 'Removed 1 items.')
+        self.assertEquals(
+            without_timings(response.text),
+            'Removed 1 items.'
+            ' Removed 1 uids from Solr in 1 batches: 1 in Xs.'
+        )
         self.assertEquals(response.code, 200)
         self.failIf(self.root.shared.get('item_uid', False))
+        self.assertEqual(self.root.sequence, 1)
 
     def test_removal_multiple(self):
         """When multiple items are present in the feed, they will be
@@ -182,7 +249,11 @@ class TestDeletion(TestCase):
         patcher.start()
         response = delete_items(self.root, request)
         patcher.stop()
-        self.assertEquals(response.body, 'Removed 2 items.')
+        self.assertEquals(
+            without_timings(response.text),
+            'Removed 2 items.'
+            ' Removed 2 uids from Solr in 1 batches: 2 in Xs.'
+        )
         self.assertEquals(response.code, 200)
         self.failIf(self.root.shared.get('foo_uid', False))
         self.failIf(self.root.shared.get('bar_uid', False))
@@ -208,14 +279,50 @@ class TestDeletion(TestCase):
         response = delete_items(self.root, request)
         patcher.stop()
         self.assertEquals(
-            response.body,
+            without_timings(response.text),
             ('Removed 1 items. '
-             '1 items could not be found for deletion: missing_uid'),
+             '1 items could not be found for deletion: missing_uid'
+             ' Removed 2 uids from Solr in 1 batches: 2 in Xs.'),
         )
         self.assertEquals(response.code, 200)
         self.failIf(self.root.shared.get('foo_uid', False))
         self.failIf(self.root.shared.get('bar_uid', False))
 
+    def test_async_removal(self):
+        """Deletions are queued when Solr is updated in the background
+        """
+        self.config.registry.settings['push.solr_async'] = 'true'
+        self.root.shared['foo_uid'] = SharedItem()
+        feed = XML_WRAPPER % XML_ENTRY % ('foo', 'foo_uid')
+        request = testing.DummyRequest(
+            body=feed,
+            content_type='application/atom+xml')
+        with patch('mysolr.Solr', FakeSolr):
+            delete_items(self.root, request)
+        self.failIf(self.root.shared.get('foo_uid', False))
+        self.assertEqual(
+            self.root.index_queue.peek(10), [('foo_uid', 'delete')])
+
+    def test_batched_removal(self):
+        """The uids are removed from Solr in batches with one commit"""
+        self.config.registry.settings['push.solr_delete_batch_size'] = '2'
+        for uid in ('a', 'b', 'c'):
+            self.root.shared[uid] = SharedItem()
+        entries = [XML_ENTRY % (uid, uid) for uid in ('a', 'b', 'c', 'b')]
+        request = testing.DummyRequest(
+            body=XML_WRAPPER % ''.join(entries),
+            content_type='application/atom+xml')
+        with patch('mysolr.Solr', FakeSolr):
+            response = delete_items(self.root, request)
+        solr = self.config.registry.solr
+        self.assertEqual(solr.deletes, ['uid:("a" OR "b")', 'uid:("c")'])
+        self.assertEqual(solr.commits, 1)
+        self.assertEqual(
+            without_timings(response.text),
+            'Removed 3 items. 1 items could not be found for deletion: b'
+            ' Removed 3 uids from Solr in 2 batches: 2 in Xs, 1 in Xs.'
+        )
+
 
 class TestCombineEntries(TestCase):
 
@@ -284,3 +391,743 @@ class TestCombineEntries(TestCase):
         self.item1.deletion_type = 'selected'
         combined = combine_entries(self.container, 'shared')
         self.assertEqual(len(combined), 3)
+
+    def test_limit(self):
+        for day, item in enumerate([self.item2, self.item3, self.item1], 1):
+            item.Modified = datetime(2013, 1, day)
+            item.reindex()
+        combined = combine_entries(self.container, 'selected', limit=1)
+        self.assertEqual(combined, [self.item3])
+        combined = combine_entries(self.container, 'shared', limit=5)
+        self.assertEqual(combined, [self.item3, self.item2])
+
+
+class TestCombineIndexedEntries(TestCombineEntries):
+    """Run the same checks against the indexes of a SharedItems folder
+    """
+
+    def setUp(self):
+        super(TestCombineIndexedEntries, self).setUp()
+        container = SharedItems()
+        for uid, item in sorted(self.container.items()):
+            container[uid] = item
+        self.container = container
+
+    def empty_container(self):
+        self.container = SharedItems()
+
+    def test_shared_with_deleted_selection(self):
+        self.item1.deletion_type = 'selected'
+        self.item1.reindex()
+        combined = combine_entries(self.container, 'shared')
+        self.assertEqual(len(combined), 3)
+
+
+class GlobalFeedBase(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('shared', '/global-shared.xml')
+        self.root = Root()
+        self.root.shared = SharedItems()
+        for day in range(1, 6):
+            item = SharedItem(Title='Item %s' % day,
+                              Modified=datetime(2013, 1, day))
+            item.feed_type = ['shared']
+            self.root.shared['item%s' % day] = item
+
+    def tearDown(self):
+        testing.tearDown()
+        self.root = None
+
+    def _get(self, headers=None, **params):
+        request = Request.blank('/global-shared.xml', headers=headers)
+        request.GET.update(params)
+        request.registry = self.config.registry
+        return global_shared(self.root, request)
+
+
+class TestFeedPaging(GlobalFeedBase):
+
+    def test_unpaged(self):
+        body = self._get().text
+        for day in range(1, 6):
+            self.assertTrue('Item %s' % day in body)
+        self.assertFalse('rel="next"' in body)
+
+    def test_first_page(self):
+        body = self._get(limit='2').text
+        self.assertTrue('Item 5' in body)
+        self.assertTrue('Item 4' in body)
+        self.assertFalse('Item 3' in body)
+        self.assertTrue('rel="next"' in body)
+        self.assertFalse('rel="previous"' in body)
+        self.assertTrue('page=3' in body)
+
+    def test_last_page(self):
+        body = self._get(limit='2', page='3').text
+        self.assertTrue('Item 1' in body)
+        self.assertFalse('Item 2' in body)
+        self.assertTrue('rel="previous"' in body)
+        self.assertFalse('rel="next"' in body)
+
+    def test_default_page_size(self):
+        self.config.registry.settings['push.feed_page_size'] = '4'
+        body = self._get().text
+        self.assertTrue('Item 2' in body)
+        self.assertFalse('Item 1' in body)
+
+    def test_max_page_size(self):
+        self.config.registry.settings['push.feed_max_page_size'] = '1'
+        body = self._get(limit='100').text
+        self.assertTrue('Item 5' in body)
+        self.assertFalse('Item 4' in body)
+
+    def test_same_as_rendered_items(self):
+        items = list(self.root.shared.feed_items('shared'))
+        expected = b''.join(stream_feed(
+            items,
+            'All Shared Entries',
+            'http://localhost/global-shared.xml',
+            'A combined feed of all entries shared to the PuSH Hub.',
+        ))
+        self.assertEqual(self._get().body, expected)
+        self.root.shared['item5'].update_from_entry({'title': u'Renamed'})
+        self.root.record_change('item5')
+        self.assertTrue(b'Renamed' in self._get().body)
+
+    def test_bad_paging(self):
+        self.assertEqual(self._get(limit='0').code, 400)
+        self.assertEqual(self._get(page='2').code, 400)
+        self.assertEqual(self._get(limit='x').code, 400)
+
+    def test_plain_container(self):
+        self.root.shared = dict(self.root.shared.items())
+        body = self._get(limit='2', page='2').text
+        self.assertTrue('Item 3' in body)
+        self.assertTrue('Item 2' in body)
+        self.assertFalse('Item 4' in body)
+        self.assertFalse('Item 1' in body)
+
+
+class TestFeedFilters(GlobalFeedBase):
+
+    def setUp(self):
+        super(TestFeedFilters, self).setUp()
+        for day in range(1, 6):
+            item = self.root.shared['item%s' % day]
+            item.Category = u'Site %s' % (day % 2)
+            item.portal_type = u'Event' if day > 3 else u'Document'
+            item.Creator = u'jane'
+            item.Subject = (u'all', u'day%s' % day)
+            item.reindex()
+
+    def _titles(self, **params):
+        body = self._get(**params).text
+        return [day for day in range(1, 6) if 'Item %s' % day in body]
+
+    def test_category(self):
+        self.assertEqual(self._titles(category='Site 1'), [1, 3, 5])
+
+    def test_intersection(self):
+        self.assertEqual(
+            self._titles(category='Site 1', portal_type='Event'), [5])
+        self.assertEqual(
+            self._titles(creator='jane', portal_type='Document'), [1, 2, 3])
+
+    def test_repeated_parameter(self):
+        request = Request.blank(
+            '/global-shared.xml?subject=all&subject=day2')
+        request.registry = self.config.registry
+        body = global_shared(self.root, request).text
+        self.assertTrue('Item 2' in body)
+        self.assertFalse('Item 3' in body)
+
+    def test_no_match(self):
+        self.assertEqual(self._titles(category='Nowhere'), [])
+
+    def test_paging_keeps_filters(self):
+        body = self._get(category='Site 1', limit='2').text
+        self.assertTrue('Item 5' in body)
+        self.assertFalse('Item 1' in body)
+        self.assertTrue('category=Site+1&amp;page=2&amp;limit=2' in body)
+
+    def test_cached_per_filter(self):
+        self.assertEqual(self._titles(), [1, 2, 3, 4, 5])
+        self.assertEqual(self._titles(portal_type='Event'), [4, 5])
+
+
+class TestFeedCaching(GlobalFeedBase):
+
+    def test_etag(self):
+        response = self._get()
+        self.assertEqual(response.etag, 'shared-0')
+        self.root.next_sequence()
+        response = self._get()
+        self.assertEqual(response.etag, 'shared-1')
+        self.assertEqual(response.last_modified.replace(microsecond=0),
+                         self.root.last_modified.replace(microsecond=0))
+
+    def test_not_modified(self):
+        etag = self._get().etag
+        response = self._get(headers={'If-None-Match': '"%s"' % etag})
+        self.assertEqual(response.status_int, 304)
+        self.root.next_sequence()
+        response = self._get(headers={'If-None-Match': '"%s"' % etag})
+        self.assertEqual(response.status_int, 200)
+
+    def test_not_modified_since(self):
+        self.root.next_sequence()
+        response = self._get()
+        since = response.headers['Last-Modified']
+        response = self._get(headers={'If-Modified-Since': since})
+        self.assertEqual(response.status_int, 304)
+
+    def test_cached_until_changed(self):
+        with patch('pushhubsearch.views.stream_feed') as stream_feed:
+            stream_feed.return_value = [b'feed']
+            self._get()
+            self._get()
+            self.assertEqual(stream_feed.call_count, 1)
+            self._get(limit='2')
+            self.assertEqual(stream_feed.call_count, 2)
+            self.root.next_sequence()
+            self._get()
+            self.assertEqual(stream_feed.call_count, 3)
+
+    def test_cached_per_host(self):
+        self._get(headers={'Host': 'internal:8080'})
+        body = self._get().text
+        self.assertTrue('http://localhost/global-shared.xml' in body)
+        self.assertFalse('internal:8080' in body)
+
+    def test_not_indexed(self):
+        """A pool that isn't reindexed yet is scanned, and not cached"""
+        self.root.shared.clear_indexes()
+        with patch('pushhubsearch.views.stream_feed',
+                   wraps=stream_feed) as wrapped:
+            body = self._get(limit='2').text
+            self._get(limit='2')
+            self.assertEqual(wrapped.call_count, 2)
+        self.assertTrue('Item 5' in body)
+        self.assertTrue('Item 4' in body)
+        self.assertFalse('Item 3' in body)
+
+    def test_cache_disabled(self):
+        self.config.registry.settings['push.feed_cache_size'] = '0'
+        with patch('pushhubsearch.views.stream_feed') as stream_feed:
+            stream_feed.return_value = [b'feed']
+            self._get()
+            self._get()
+            self.assertEqual(stream_feed.call_count, 2)
+
+    def test_large_feed_not_cached(self):
+        self.config.registry.settings['push.feed_cache_max_size'] = '10'
+        with patch('pushhubsearch.views.stream_feed') as stream_feed:
+            stream_feed.return_value = [b'<feed>', b'</feed>']
+            response = self._get()
+            self.assertEqual(response.body, b'<feed></feed>')
+            self.assertEqual(response.content_length, 13)
+            self._get()
+            self.assertEqual(stream_feed.call_count, 2)
+
+    def test_filtered_not_cached(self):
+        with patch('pushhubsearch.views.stream_feed') as stream_feed:
+            stream_feed.return_value = [b'feed']
+            self._get(category='Site 1')
+            self._get(category='Site 1')
+            self.assertEqual(stream_feed.call_count, 2)
+
+    def test_default_max_size(self):
+        with patch('pushhubsearch.views.stream_feed') as stream_feed:
+            stream_feed.return_value = [b'x' * (1024 * 1024 + 1)]
+            self._get()
+            self._get()
+            self.assertEqual(stream_feed.call_count, 2)
+
+
+class TestUpdateItems(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.registry.settings['push.solr_uri'] = 'foo'
+        self.root = Root()
+        self.root.shared = SharedItems()
+        self.patcher = patch('mysolr.Solr', FakeSolr)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        testing.tearDown()
+        self.root = None
+
+    def _push(self, body, content_type='application/atom+xml'):
+        request = testing.DummyRequest(body=body, content_type=content_type)
+        view = UpdateItems(self.root, request)
+        return view, view()
+
+    def test_bad_content_type(self):
+        view, response = self._push('', content_type='text/plain')
+        self.assertEqual(response.code, 400)
+
+    def test_shared_solr(self):
+        """The Solr client is created once and reused by later requests."""
+        first, response = self._push(shared_feed(
+            ('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        second, response = self._push(shared_feed(
+            ('bar', 'Bar', '2013-01-02T00:00:00Z')))
+        self.assertTrue(first.solr is second.solr)
+        self.assertTrue(first.solr is self.config.registry.solr)
+        self.assertEqual(first.solr.solr_uri, 'foo')
+        session = first.solr.kwargs['make_request']
+        self.assertEqual(session.timeout, 10)
+        self.assertEqual(session.get_adapter('http://foo')._pool_maxsize, 10)
+
+    def test_snapshot_on_commit(self):
+        writer = self.config.registry.snapshot_writer = Mock()
+        self._push(shared_feed(('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        writer.schedule_on_commit.assert_called_with(transaction.get())
+
+    def test_unchanged_update(self):
+        feed = shared_feed(('foo', 'Foo', '2013-01-01T00:00:00Z'))
+        self._push(feed)
+        sequence = self.root.sequence
+        writer = self.config.registry.snapshot_writer = Mock()
+        view, response = self._push(feed)
+        self.assertEqual(view.update_count, 1)
+        self.assertEqual(self.root.sequence, sequence)
+        self.assertFalse(writer.schedule_on_commit.called)
+        self._push(shared_feed(('foo', 'Bar', '2013-01-01T00:00:00Z')))
+        self.assertEqual(self.root.sequence, sequence + 1)
+        self.assertTrue(writer.schedule_on_commit.called)
+
+    def test_create(self):
+        view, response = self._push(shared_feed(
+            ('foo', 'Foo', '2013-01-01T00:00:00Z'),
+            ('bar', 'Bar', '2013-01-02T00:00:00Z'),
+        ))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(view.create_count, 2)
+        self.assertEqual(self.root.shared['foo'].Title, 'Foo')
+        self.assertEqual(self.root.shared['foo'].feed_type, ('shared', ))
+        self.assertEqual(
+            [i.__name__ for i in self.root.shared.feed_items('shared')],
+            ['bar', 'foo'],
+        )
+        indexed = view.solr.updated[0]
+        self.assertEqual(sorted(d['uid'] for d in indexed), ['bar', 'foo'])
+
+    def test_atomic_updates(self):
+        """Updated items only send the fields that changed"""
+        self.config.registry.settings['push.solr_atomic_updates'] = 'true'
+        self._push(shared_feed(('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        solr = self.config.registry.solr
+        self.assertEqual(solr.updated[0][0]['Title'], 'Foo')
+        self._push(shared_feed(('foo', 'Bar', '2013-01-01T00:00:00Z')))
+        self.assertEqual(solr.updated[1], [{
+            'uid': 'foo',
+            'Title': {'set': 'Bar'},
+            'Description': {'set': 'Summary of Bar'},
+            'content': {'set': 'Body of Bar'},
+        }])
+        self._push(shared_feed(('foo', 'Bar', '2013-01-01T00:00:00Z')))
+        self.assertEqual(len(solr.updated), 2)
+
+    def test_fast_parser(self):
+        self.config.registry.settings['push.fast_parser'] = 'true'
+        view, response = self._push(shared_feed(
+            ('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        item = self.root.shared['foo']
+        self.assertEqual(item.Title, 'Foo')
+        self.assertEqual(item.url, 'http://example.com/foo')
+        self.assertEqual(item.feed_type, ('shared', ))
+        self.assertEqual(item.content[0]['value'], 'Body of Foo')
+
+    def test_update(self):
+        self._push(shared_feed(('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        view, response = self._push(
+            shared_feed(('foo', 'New Foo', '2013-01-02T00:00:00Z')))
+        self.assertEqual(view.create_count, 0)
+        self.assertEqual(view.update_count, 1)
+        self.assertEqual(self.root.shared['foo'].Title, 'New Foo')
+
+    def test_reshare_deleted_item(self):
+        """Undeleting an item during an update doesn't need extra
+        calls to Solr.
+        """
+        self._push(shared_feed(('foo', 'Foo', '2013-01-01T00:00:00Z')))
+        item = self.root.shared['foo']
+        item.add_feed('deleted')
+        item.deletion_type = 'shared'
+        self.config.registry.solr.updated = []
+        view, response = self._push(
+            shared_feed(('foo', 'Foo', '2013-01-02T00:00:00Z')))
+        self.assertEqual(item.feed_type, ('shared', ))
+        self.assertFalse(hasattr(item, 'deletion_type'))
+        self.assertEqual(view.solr.searches, [])
+        self.assertEqual(len(view.solr.updated), 1)
+        self.assertEqual(view.solr.updated[0][0]['feed_type'], ['shared'])
+
+    def test_async_queues_items(self):
+        self.config.registry.settings['push.solr_async'] = 'true'
+        view, response = self._push(shared_feed(
+            ('foo', 'Foo', '2013-01-01T00:00:00Z'),
+        ))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(view.solr.updated, [])
+        self.assertEqual(self.root.index_queue.peek(10), [('foo', 'index')])
+
+    def test_stamps_changes(self):
+        self._push(shared_feed(
+            ('foo', 'Foo', '2013-01-01T00:00:00Z'),
+            ('bar', 'Bar', '2013-01-02T00:00:00Z'),
+        ))
+        self.assertEqual(self.root.sequence, 2)
+        self.assertEqual(self.root.shared['foo'].sequence, 1)
+        self._push(shared_feed(('foo', 'Foo', '2013-01-03T00:00:00Z')))
+        self.assertEqual(self.root.shared['foo'].sequence, 3)
+        changes = [(seq, uid)
+                   for seq, uid, item, deleted in self.root.shared.changes()]
+        self.assertEqual(changes, [(2, 'bar'), (3, 'foo')])
+
+
+class TestBatchedUpdate(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        settings = self.config.registry.settings
+        settings['push.solr_uri'] = 'foo'
+        settings['push.update_batch_size'] = '2'
+        settings['tm.attempts'] = '3'
+        self.db = DB(None)
+        # Like pyramid_tm with `tm.manager_hook = pyramid_tm.explicit_manager`
+        self.tm = transaction.TransactionManager(explicit=True)
+        self.conn = self.db.open(transaction_manager=self.tm)
+        self.tm.begin()
+        self.root = appmaker(self.conn.root())
+        self.patcher = patch('mysolr.Solr', FakeSolr)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tm.abort()
+        self.conn.close()
+        self.db.close()
+        testing.tearDown()
+
+    def _push(self):
+        body = shared_feed(*[
+            ('item-%s' % i, 'Item %s' % i, '2013-01-0%sT00:00:00Z' % (i + 1))
+            for i in range(5)
+        ])
+        request = testing.DummyRequest(
+            body=body, content_type='application/atom+xml')
+        request.tm = self.tm
+        return UpdateItems(self.root, request)()
+
+    def _committed(self):
+        conn = self.db.open(
+            transaction_manager=transaction.TransactionManager())
+        try:
+            return sorted(conn.root()['app_root'].shared.keys())
+        finally:
+            conn.close()
+
+    def test_batches(self):
+        """Every batch is indexed and committed on its own"""
+        response = self._push()
+        self.assertEqual(
+            self._committed(), ['item-%s' % i for i in range(5)])
+        solr = self.config.registry.solr
+        self.assertEqual([len(docs) for docs in solr.updated], [2, 2, 1])
+        self.assertEqual(
+            response.text,
+            'Committed batch 1 (2 items). Committed batch 2 (4 items). '
+            'Committed batch 3 (5 items). 5 items created. 0 items updated.'
+        )
+
+    def test_conflict(self):
+        """A conflict only replays the batch it happened in"""
+        commit = self.tm.commit
+        commits = []
+
+        def conflicting():
+            commits.append(len(commits))
+            if len(commits) == 2:
+                raise ConflictError()
+            commit()
+
+        with patch.object(self.tm, 'commit', conflicting):
+            response = self._push()
+        self.assertEqual(len(commits), 4)
+        self.assertEqual(
+            self._committed(), ['item-%s' % i for i in range(5)])
+        self.assertTrue(response.text.endswith(
+            'Committed batch 3 (5 items). 5 items created. 0 items updated.'))
+        solr = self.config.registry.solr
+        self.assertEqual([len(docs) for docs in solr.updated], [2, 2, 2, 1])
+
+
+class TestConcurrentUpdates(TestCase):
+    """Push to /update from several threads at once, retrying on
+    conflicts like pyramid_tm does.
+    """
+    threads = 4
+    pushes = 5
+    attempts = 20
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.registry.settings['push.solr_uri'] = 'foo'
+        self.tempdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage('%s/Data.fs' % self.tempdir))
+        conn = self.db.open()
+        appmaker(conn.root())
+        conn.close()
+        self.patcher = patch('mysolr.Solr', FakeSolr)
+        self.patcher.start()
+        self.retries = []
+        self.errors = []
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+        testing.tearDown()
+
+    def _pusher(self, number):
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager=tm)
+        try:
+            for push in range(self.pushes):
+                body = shared_feed(
+                    ('item-%s-%s' % (number, push), 'Item',
+                     '2013-01-01T00:00:00Z'),
+                    ('common', 'Common', '2013-01-0%sT00:00:00Z' % (push + 1)),
+                )
+                for attempt in range(self.attempts):
+                    request = testing.DummyRequest(
+                        body=body, content_type='application/atom+xml')
+                    request.registry = self.config.registry
+                    try:
+                        UpdateItems(conn.root()['app_root'], request)()
+                        tm.commit()
+                    except ConflictError:
+                        tm.abort()
+                        self.retries.append(number)
+                    else:
+                        break
+                else:
+                    self.errors.append('Gave up on %s' % push)
+        except Exception as e:
+            self.errors.append(e)
+            raise
+        finally:
+            tm.abort()
+            conn.close()
+
+    def test_hammer(self):
+        workers = [threading.Thread(target=self._pusher, args=(number,))
+                   for number in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.errors, [])
+        conn = self.db.open()
+        try:
+            root = conn.root()['app_root']
+            uids = sorted(
+                ['item-%s-%s' % (number, push)
+                 for number in range(self.threads)
+                 for push in range(self.pushes)] + ['common'])
+            self.assertEqual(sorted(root.shared.keys()), uids)
+            self.assertEqual(
+                sorted(i.__name__ for i in root.shared.feed_items('shared')),
+                uids)
+            # Every committed push recorded its new item, and the common
+            # one unless another thread had already pushed the same date
+            self.assertTrue(
+                self.threads * self.pushes < root.sequence <=
+                2 * self.threads * self.pushes, root.sequence)
+            changes = list(root.shared.changes())
+            self.assertEqual(sorted(change[1] for change in changes), uids)
+            for sequence, uid, item, deleted in changes:
+                self.assertEqual(item.sequence, sequence)
+            # Pushes still serialize on the change sequence: each
+            # commit can make at most every other thread retry once
+            self.assertTrue(
+                len(self.retries) <=
+                (self.threads - 1) * self.threads * self.pushes,
+                '%s retries' % len(self.retries))
+        finally:
+            conn.close()
+
+
+class TestTileFeed(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('tile', '/tile.xml')
+        self.root = Root()
+        self.root.shared = SharedItems()
+        for uid, tiles, removed in (('one', ['http://a/1'], []),
+                                    ('two', ['http://a/2'], ['http://a/1'])):
+            item = SharedItem(Title='Item %s' % uid, tile_urls=tiles,
+                              deleted_tile_urls=removed)
+            item.feed_type = ['shared']
+            self.root.shared[uid] = item
+
+    def tearDown(self):
+        testing.tearDown()
+        self.root = None
+
+    def _get(self, **params):
+        request = Request.blank('/tile.xml')
+        request.GET.update(params)
+        request.registry = self.config.registry
+        return tile_feed(self.root, request)
+
+    def test_on_tile(self):
+        body = self._get(url='http://a/1').text
+        self.assertTrue('Item one' in body)
+        self.assertFalse('Item two' in body)
+
+    def test_removed(self):
+        body = self._get(url='http://a/1', removed='true').text
+        self.assertFalse('Item one' in body)
+        self.assertTrue('Item two' in body)
+        self.assertTrue('removed=true' in body)
+
+    def test_no_url(self):
+        self.assertEqual(self._get().code, 400)
+
+
+class SearchSolr(object):
+    """Finds the uids it is told to, and counts the searches"""
+
+    def __init__(self, uids, status=200):
+        self.uids = uids
+        self.status = status
+        self.searches = []
+
+    def search(self, **params):
+        self.searches.append(params)
+        response = FakeResponse([{'uid': uid} for uid in self.uids])
+        response.status = self.status
+        return response
+
+
+class TestSearch(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('search', '/search')
+        self.solr = self.config.registry.solr = SearchSolr(['two', 'gone'])
+        self.root = Root()
+        self.root.shared = SharedItems()
+        for uid in ('one', 'two'):
+            item = SharedItem(Title='Item %s' % uid)
+            item.feed_type = ['shared']
+            self.root.shared[uid] = item
+
+    def tearDown(self):
+        testing.tearDown()
+        self.root = None
+
+    def _get(self, **params):
+        request = Request.blank('/search')
+        request.GET.update(params)
+        request.registry = self.config.registry
+        return search(self.root, request)
+
+    def test_search(self):
+        body = self._get(q='budget category:Site').text
+        self.assertTrue('Item two' in body)
+        self.assertFalse('Item one' in body)
+        params = self.solr.searches[0]
+        self.assertEqual(params['q'], '"budget"')
+        self.assertEqual(params['fq'], ['Category:"Site"'])
+        self.assertEqual(params['rows'], 20)
+
+    def test_cached(self):
+        self._get(q='a b')
+        self._get(q='b  a', limit='20')
+        self.assertEqual(len(self.solr.searches), 1)
+        self._get(q='a b', limit='5')
+        self.assertEqual(len(self.solr.searches), 2)
+
+    def test_writes_clear_the_cache(self):
+        self._get(q='budget')
+        update_documents(FakeSolr(), [{'uid': 'one'}])
+        self._get(q='budget')
+        self.assertEqual(len(self.solr.searches), 2)
+
+    def test_bad_search(self):
+        self.assertEqual(self._get(q='modified:someday').code, 400)
+        self.solr.status = 500
+        self.assertEqual(self._get(q='budget').code, 502)
+
+
+class TestChangesFeed(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.add_route('changes', '/changes.xml')
+        self.root = Root()
+        self.root.shared = SharedItems()
+        for uid in ('one', 'two', 'three'):
+            item = SharedItem(Title='Item %s' % uid)
+            item.feed_type = ['shared']
+            self.root.shared[uid] = item
+            self.root.record_change(uid)
+
+    def tearDown(self):
+        testing.tearDown()
+        self.root = None
+
+    def _get(self, **params):
+        request = Request.blank('/changes.xml')
+        request.GET.update(params)
+        request.registry = self.config.registry
+        return changes_feed(self.root, request)
+
+    def test_all_changes(self):
+        body = self._get().text
+        for uid in ('one', 'two', 'three'):
+            self.assertTrue('Item %s' % uid in body)
+        self.assertTrue('<push:sequence>3</push:sequence>' in body)
+
+    def test_since(self):
+        body = self._get(since='2').text
+        self.assertFalse('Item one' in body)
+        self.assertFalse('Item two' in body)
+        self.assertTrue('Item three' in body)
+
+    def test_updated_item_moves_to_the_end(self):
+        self.root.record_change('one')
+        body = self._get(since='3').text
+        self.assertTrue('Item one' in body)
+        self.assertFalse('Item two' in body)
+
+    def test_tombstones(self):
+        del self.root.shared['two']
+        self.root.record_change('two')
+        body = self._get(since='3').text
+        self.assertTrue('at:deleted-entry' in body)
+        self.assertTrue('ref="urn:syndication:two"' in body)
+        self.assertFalse('Item one' in body)
+
+    def test_limit(self):
+        body = self._get(limit='2').text
+        self.assertTrue('Item two' in body)
+        self.assertFalse('Item three' in body)
+        self.assertTrue('rel="next"' in body)
+        self.assertTrue('since=2' in body)
+        self.assertTrue('<push:sequence>2</push:sequence>' in body)
+        body = self._get(limit='2', since='2').text
+        self.assertTrue('Item three' in body)
+        self.assertFalse('rel="next"' in body)
+
+    def test_bad_since(self):
+        self.assertEqual(self._get(since='x').code, 400)
@@ -28,6 +28,14 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+import threading
+from collections import OrderedDict
+
+from .indexing import solr_document
+from .indexing import uid_query
+from .indexing import update_documents
+
+
 def normalize_uid(uuid):
     if uuid.startswith('urn:syndication'):
         return uuid[16:]
@@ -35,20 +43,84 @@ def normalize_uid(uuid):
         return uuid
 
 
-def remove_deleted_status(uid, shared, solr):
-    response = solr.search(**{'q': 'uid:"%s"' % (uid,)})
+def clear_deleted_status(item):
+    """Take an item out of the deleted feed"""
+    if 'deleted' in item.feed_type:
+        item.remove_feed('deleted')
+        if hasattr(item, 'deletion_type'):
+            delattr(item, 'deletion_type')
+        item.reindex()
 
-    # XXX: should we update the document or remove it?
-    for document in response.documents:
-        if 'deleted' in document['feed_type']:
-            document['feed_type'].remove('deleted')
 
-    # update index with modified documents
-    solr.update(response.documents, commit=True)
+def remove_deleted_statuses(uids, shared, solr, queue=None):
+    """Take the items out of the deleted feed, and return the Solr
+    documents that need to be updated for it.
 
-    if uid in shared:
-        if 'deleted' in shared[uid].feed_type:
-            shared[uid].feed_type.remove('deleted')
-            delattr(shared[uid], 'deletion_type')
+    The documents of the items in the database are built from them,
+    the others are fetched from Solr with a single query. Nothing is
+    sent to Solr, callers fold the documents into their own update.
+    Items are queued instead when Solr is updated in the background.
+    """
+    documents = []
+    remote = []
+    for uid in uids:
+        if uid not in shared:
+            remote.append(uid)
+            continue
+        item = shared[uid]
+        clear_deleted_status(item)
+        if queue is not None:
+            queue.index(uid)
+        else:
+            documents.append(solr_document(item))
+    if remote:
+        response = solr.search(q=uid_query(remote), rows=len(remote))
+        # XXX: should we update the document or remove it?
+        for document in response.documents:
+            if 'deleted' in document['feed_type']:
+                document['feed_type'].remove('deleted')
+            documents.append(document)
+    return documents
 
+
+def remove_deleted_status(uid, shared, solr, queue=None):
+    documents = remove_deleted_statuses([uid], shared, solr, queue)
+    # update index with modified documents
+    if documents:
+        update_documents(solr, documents, commit=True)
     return True
+
+
+class LRUCache(object):
+    """A small, thread safe, least recently used cache
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.size < 1:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -28,14 +28,36 @@ OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-import copy
-import feedparser
+import heapq
+import tempfile
+from itertools import islice
+import transaction
+from ZODB.POSException import ConflictError
 from pyramid.httpexceptions import HTTPOk
+from pyramid.httpexceptions import HTTPBadGateway
 from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.response import FileIter
 from pyramid.response import Response
+from pyramid.settings import asbool
 from pyramid.url import route_url
+from .models import IndexQueue
 from .models import SharedItem
+from .models import SharedItems
 from .feedgen import Atom1Feed
+from .feedgen import feed_item
+from .indexing import DELETE_BATCH_SIZE
+from .indexing import atomic_document
+from .indexing import delete_documents
+from .indexing import get_solr
+from .indexing import solr_document
+from .indexing import solr_generation
+from .indexing import update_documents
+from .parser import parse_entries
+from .search import Search
+from .search import SearchCache
+from .utils import LRUCache
+from .utils import clear_deleted_status
 from .utils import normalize_uid
 from .utils import remove_deleted_status
 
@@ -48,6 +70,73 @@ ALLOWED_CONTENT = (
     'application/rss+xml',
 )
 
+# The title and description of each global feed
+GLOBAL_FEEDS = {
+    'shared': (
+        'All Shared Entries',
+        'A combined feed of all entries shared to the PuSH Hub.',
+    ),
+    'selected': (
+        'All Selected Entries',
+        'A combined feed of all entries selected across the PuSH Hub.',
+    ),
+    'deleted': (
+        'All Deleted Entries',
+        'A combined feed of all entries that were deleted '
+        ' across the PuSH Hub.',
+    ),
+}
+
+# The query parameters that filter the global feeds, and the index of
+# `SharedItems` each one is looked up in
+FEED_FILTERS = {
+    'category': 'Category',
+    'creator': 'Creator',
+    'portal_type': 'portal_type',
+    'subject': 'Subject',
+}
+
+# Number of search results returned when no `limit` is given
+SEARCH_ROWS = 20
+
+
+def feed_entries(request):
+    """The entries of the feed pushed in the request"""
+    fast = asbool(request.registry.settings.get('push.fast_parser', False))
+    return parse_entries(request.body, fast=fast)
+
+
+def request_tm(request):
+    """The transaction manager of the request. With pyramid_tm it is
+    `request.tm`, which the database connection is tied to when
+    `tm.manager_hook` gives it a manager of its own.
+    """
+    tm = getattr(request, 'tm', None)
+    if tm is None:
+        tm = transaction.manager
+    return tm
+
+
+def snapshot_on_commit(request):
+    """Have the feed snapshots written once the changes of the request
+    are committed, when `push.snapshot_dir` is set.
+    """
+    writer = getattr(request.registry, 'snapshot_writer', None)
+    if writer is not None:
+        writer.schedule_on_commit(request_tm(request).get())
+
+
+def index_queue(context, request):
+    """The queue of items to index when `push.solr_async` is on, and
+    Solr is updated in the background. Returns None otherwise.
+    """
+    settings = request.registry.settings
+    if not asbool(settings.get('push.solr_async', False)):
+        return None
+    if context.index_queue is None:
+        context.index_queue = IndexQueue()
+    return context.index_queue
+
 
 class UpdateItems(object):
     """Create a new SharedItem or update it if it already exists.
@@ -62,13 +151,15 @@ class UpdateItems(object):
         self.update_count = 0
         self.messages = []
         self.to_index = []
-        solr_uri = request.registry.settings.get('push.solr_uri', None)
-        if solr_uri is None:
-            raise AttributeError(u'A push.solr_uri is required')
-        # XXX: We are importing solr here to be able to mock it in the tests
-        from mysolr import Solr
-        self.solr = Solr(solr_uri)
+        # The uids in `to_index`, and the uids created by the request
+        self.indexing = set()
+        self.created = set()
+        self.batch_count = 0
+        self.solr = get_solr(request.registry)
         self.shared = context.shared
+        self.queue = index_queue(context, request)
+        self.atomic = asbool(request.registry.settings.get(
+            'push.solr_atomic_updates', False))
 
     def __call__(self):
         #  If the request isn't an RSS feed, bail out
@@ -90,19 +181,72 @@ class UpdateItems(object):
     def _process_items(self):
         """Get a list of new items to create and existing items that
         need to be updated.
+
+        With `push.update_batch_size` the entries are indexed and
+        committed in batches of that size, so a large push doesn't
+        build up one huge transaction.
+        """
+        settings = self.request.registry.settings
+        batch_size = int(settings.get('push.update_batch_size', 0))
+        entries = feed_entries(self.request)
+        if batch_size < 1:
+            for item in entries:
+                self._process_item(item)
+            return
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            self._commit_batch(batch)
+
+    def _process_item(self, item):
+        uid = item['id']
+        # Get the uid, minus the urn:syndication bit
+        item['uid'] = uid = normalize_uid(uid)
+        logger.info('Processing item %s' % uid)
+        if uid in self.shared:
+            self._update_item(item)
+        else:
+            self._create_item(item)
+
+    def _commit_batch(self, batch):
+        """Create / update, index and commit a batch of entries. A
+        conflict only replays the batch, up to `tm.attempts` times.
         """
-        shared_content = feedparser.parse(self.request.body)
-        for item in shared_content.entries:
-            uid = item['id']
-            # Get the uid, minus the urn:syndication bit
-            item['uid'] = uid = normalize_uid(uid)
-            logger.info('Processing item %s' % uid)
-            item['link'] = item.link
-            item['feed_link'] = shared_content.feed.link
-            if uid in self.shared:
-                self._update_item(item)
+        attempts = int(self.request.registry.settings.get('tm.attempts', 1))
+        counts = (self.create_count, self.update_count)
+        tm = request_tm(self.request)
+        for attempt in range(1, attempts + 1):
+            try:
+                for item in batch:
+                    self._process_item(item)
+                self._update_index()
+                tm.commit()
+                # An explicit manager has to be told, and pyramid_tm
+                # commits the rest of the request itself
+                tm.begin()
+            except ConflictError:
+                tm.abort()
+                tm.begin()
+                self.create_count, self.update_count = counts
+                self.to_index = []
+                self.indexing = set()
+                if attempt == attempts:
+                    raise
+                logger.info('Conflict committing a batch, retrying')
             else:
-                self._create_item(item)
+                break
+        self.to_index = []
+        self.indexing = set()
+        self.batch_count += 1
+        processed = self.create_count + self.update_count
+        msg = "Committed batch %s (%s items)." % (self.batch_count, processed)
+        logger.info(msg)
+        self.messages.append(msg)
+        # Keep the memory of the connection bounded
+        jar = getattr(self.context, '_p_jar', None)
+        if jar is not None:
+            jar.cacheGC()
 
     def _create_item(self, entry):
         """Create new items in the feed
@@ -116,7 +260,10 @@ class UpdateItems(object):
         new_item.__name__ = uid
         new_item.__parent__ = self.shared
         self.shared.add(uid, new_item)
-        self.to_index.append(self.shared[uid])
+        self.context.record_change(uid)
+        snapshot_on_commit(self.request)
+        self.created.add(uid)
+        self._add_to_index(self.shared[uid])
         self.create_count += 1
 
     def _update_item(self, entry):
@@ -129,55 +276,58 @@ class UpdateItems(object):
         #      the `add` method on the folder not setting them?
         obj.__name__ = uid
         obj.__parent__ = self.shared
+        if uid not in self.indexing:
+            # Only track the changes made until the item is indexed
+            obj.clear_changes()
         selected_or_shared = (
             'selected' in entry['feed_link'] or
             'shared' in entry['feed_link']
         )
         if selected_or_shared and hasattr(obj, 'deletion_type'):
-            remove_deleted_status(uid, self.shared, self.solr)
+            # The item is sent to Solr with the rest of the update, so
+            # its document gets the new feed_type along the way.
+            clear_deleted_status(obj)
         obj.update_from_entry(entry)
-        self.to_index.append(obj)
+        changed = obj.changed_fields()
+        logger.debug('Changed fields of %s: %s' % (
+            uid, ', '.join(sorted(changed))))
+        if changed:
+            # A push repeating what is stored leaves the feeds alone
+            self.context.record_change(uid)
+            snapshot_on_commit(self.request)
+        self._add_to_index(obj)
         self.update_count += 1
 
-    def _update_index(self):
-        """Clean up the item dictionaries to contain only items that
-        are valid and send them over to Solr for indexing.
+    def _add_to_index(self, item):
+        if item.__name__ not in self.indexing:
+            self.indexing.add(item.__name__)
+            self.to_index.append(item)
 
-        NOTE: Solr may error out on index if it receives a field it is
-              not aware of. We should change this code to look up the
-              Solr schema, and remove attributes that it doesn't know,
-              like __name__ and __parent__ below.
+    def _update_index(self):
+        """Send the created and updated items over to Solr for
+        indexing, or queue them when Solr is updated in the background.
         """
         logger.debug('Updating index for %s objects' % len(self.to_index))
+        if not self.to_index:
+            return
+        if self.queue is not None:
+            for item in self.to_index:
+                self.queue.index(item.__name__)
+            return
         cleaned = []
-        ignored_attrs = [
-            '__name__',
-            '__parent__',
-            'deletion_type',
-        ]
         for item in self.to_index:
-            item_dict = copy.deepcopy(item.__dict__)
-            if 'Modified' in item_dict:
-                if hasattr(item_dict['Modified'], 'isoformat'):
-                    mod_date = item_dict['Modified'].isoformat()
-                else:
-                    mod_date = item_dict['Modified']
-                # Make sure the date is acceptable to Solr, strip off
-                # the +00:00 and replace it with a Z
-                item_dict['Modified'] = "%sZ" % mod_date[:-6]
-            if 'content' in item_dict:
-                items = [item['value'] for item in item_dict['content']]
-                if items:
-                    # XXX: use first content item, discard the rest
-                    item_dict['content'] = items[0]
-            item_dict['uid'] = item_dict['__name__']
-            # XXX: Need to look up the schema, then modify the dict
-            #      based on that.
-            for attr in ignored_attrs:
-                item_dict.pop(attr, '')
-            cleaned.append(item_dict)
+            if self.atomic and item.__name__ not in self.created:
+                # Only send the fields that changed
+                document = atomic_document(item, item.changed_fields())
+                if document is not None:
+                    cleaned.append(document)
+            else:
+                cleaned.append(solr_document(item))
+            item.clear_changes()
+        if not cleaned:
+            return
         # XXX: Need to handle Solr errors here
-        response = self.solr.update(cleaned)
+        response = update_documents(self.solr, cleaned)
         return response
 
 
@@ -188,13 +338,13 @@ def update_deletions(context, request):
     uid = request.POST.get('uid')
     if not uid:
         return
-    solr_uri = request.registry.settings.get('push.solr_uri', None)
-    if solr_uri is None:
-        raise AttributeError(u'A push.solr_uri is required')
-    from mysolr import Solr
-    solr = Solr(solr_uri)
+    solr = get_solr(request.registry)
     logger.debug('Remove deleted status')
-    remove_deleted_status(uid, context.shared, solr)
+    remove_deleted_status(uid, context.shared, solr,
+                          index_queue(context, request))
+    if uid in context.shared:
+        context.record_change(uid)
+        snapshot_on_commit(request)
     return HTTPOk(body="Item no longer marked as deleted")
 
 
@@ -208,25 +358,26 @@ def delete_items(context, request):
             "following: %s"
         ) % ", ".join(ALLOWED_CONTENT)
         return HTTPBadRequest(body=body_msg)
-    solr_uri = request.registry.settings.get('push.solr_uri', None)
-    if solr_uri is None:
-        raise AttributeError(u'A push.solr_uri is required')
-    # XXX: We are importing solr here to be able to mock it in the tests
-    from mysolr import Solr
-    solr = Solr(solr_uri)
-    shared_content = feedparser.parse(request.body)
+    queue = index_queue(context, request)
     missing = []
     removed = 0
-    for item in shared_content.entries:
+    uids = []
+    seen = set()
+    for item in feed_entries(request):
         uid = item['id']
         uid = normalize_uid(uid)
         logger.debug('Deleting %s' % uid)
+        if queue is not None:
+            queue.unindex(uid)
+        elif uid not in seen:
+            seen.add(uid)
+            uids.append(uid)
         if uid not in context.shared:
             missing.append(uid)
-            solr.delete_by_key(uid)
             continue
         del context.shared[uid]
-        solr.delete_by_key(uid)
+        context.record_change(uid)
+        snapshot_on_commit(request)
         removed += 1
     body_msg = "Removed %s items." % removed
     if missing:
@@ -235,89 +386,429 @@ def delete_items(context, request):
         msg = msg_str % args
         logger.warn(msg)
         body_msg += msg
+    if uids:
+        batch_size = int(request.registry.settings.get(
+            'push.solr_delete_batch_size', DELETE_BATCH_SIZE))
+        timings = delete_documents(
+            get_solr(request.registry), uids, batch_size=batch_size)
+        body_msg += " Removed %s uids from Solr in %s batches: %s." % (
+            len(uids), len(timings),
+            ', '.join('%s in %.3fs' % timing for timing in timings))
     return HTTPOk(body=body_msg)
 
 
-def combine_entries(container, feed_name):
-    """Combines all feeds of a given type (e.g. Shared, Selected)
+def combine_entries(container, feed_name, limit=None):
+    """Combines all feeds of a given type (e.g. Shared, Selected),
+    or only the newest `limit` entries of them.
     """
     logger.debug('Combining entries for %s' % feed_name)
-    if feed_name == 'deleted':
-        results = [entry for entry in container.values()
-                   if feed_name in entry.feed_type]
-    else:
-        results = []
-        for entry in container.values():
-            feed_type = entry.feed_type
-            feed_match = feed_name in feed_type
-            feature_del = (
-                'deleted' in feed_type and
-                entry.deletion_type == 'featured'
-            )
-            if not feed_match or (feed_match and feature_del):
-                continue
-            results.append(entry)
-    results.sort(key=lambda x: x.Modified, reverse=True)
-    return results
-
-
-def create_feed(entries, title, link, description):
-    """Combine the entries into an actual Atom feed."""
+    if isinstance(container, SharedItems):
+        # The feed index is already sorted by Modified
+        return list(container.feed_items(feed_name, limit=limit))
+    results = (entry for entry in container.values()
+               if feed_name in entry.global_feeds())
+    if limit is not None:
+        # Only keep the newest entries around instead of sorting
+        # all of them
+        return heapq.nlargest(limit, results, key=lambda x: x.Modified)
+    return sorted(results, key=lambda x: x.Modified, reverse=True)
+
+
+def feed_chunks(entries):
+    """The `Atom1Feed.stream` items for shared items, some of which
+    may already be serialized entries.
+    """
+    for entry in entries:
+        if isinstance(entry, bytes):
+            yield entry
+        else:
+            yield feed_item(entry)
+
+
+def stream_feed(entries, title, link, description, paging_links=None,
+                updated=None):
+    """Serialize the entries as an Atom feed, yielding it an entry at
+    a time.
+
+    `updated` is the date of the feed, needed when the first entry is
+    already serialized.
+    """
     new_feed = Atom1Feed(
         title=title,
         link=link,
         description=description,
+        paging_links=paging_links,
+        updated=updated,
     )
-    for entry in entries:
-        data = dict(
-            pubdate=entry.Modified,
-            unique_id='urn:syndication:%s' % entry.__name__,
-            categories=entry.Subject,
-            category={'term': entry.Category, 'label': u'Site Title'},
-            author_name=entry.Creator,
-        )
-        data['push:portal_type'] = entry.portal_type
-        # Tile urls are added into one element for now
-        data['push:tile_urls'] = '|'.join(entry.tile_urls).lstrip('|')
-        data['push:deleted_tile_urls'] = '|'.join(
-            entry.deleted_tile_urls).lstrip('|')
-        if getattr(entry, 'content', None):
-            data['content'] = entry.content
-        if hasattr(entry, 'deletion_type'):
-            data['push:deletion_type'] = entry.deletion_type
-        new_feed.add_item(
-            entry.Title,
-            entry.url,
-            entry.Description,
-            **data
+    return new_feed.stream(feed_chunks(entries))
+
+
+def create_feed(entries, title, link, description, paging_links=None,
+                updated=None):
+    """Combine the entries into an actual Atom feed."""
+    return b''.join(stream_feed(
+        entries, title, link, description, paging_links=paging_links,
+        updated=updated))
+
+
+def spool_feed(chunks, max_size=1024 * 1024):
+    """Write a streamed feed to a temporary file, which only moves
+    to disk once it is bigger than `max_size`.
+
+    The feed has to be written out before the view returns: the ZODB
+    connection is closed when the request is finished, before the
+    server gets to iterate over the response.
+    """
+    body_file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        body_file.write(chunk)
+    size = body_file.tell()
+    body_file.seek(0)
+    return body_file, size
+
+
+def feed_limit(request):
+    """Get the number of entries to put in a feed from the request.
+
+    `push.feed_page_size` is used when no `limit` is given, and
+    `push.feed_max_page_size` caps it. Returns None if the whole feed
+    was asked for, and raises a ValueError for bad values.
+    """
+    settings = request.registry.settings
+    limit = request.params.get('limit')
+    if limit is None:
+        limit = settings.get('push.feed_page_size') or None
+    if limit is None:
+        return None
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError('limit must be 1 or more')
+    max_limit = int(settings.get('push.feed_max_page_size') or 0)
+    if max_limit:
+        limit = min(limit, max_limit)
+    return limit
+
+
+def feed_paging(request):
+    """Get the page number and page size from the request.
+
+    Returns a `(page, limit)` tuple, see `feed_limit`. Raises a
+    ValueError for bad values.
+    """
+    page = int(request.params.get('page', 1))
+    if page < 1:
+        raise ValueError('page must be 1 or more')
+    limit = feed_limit(request)
+    if limit is None and page != 1:
+        raise ValueError('limit is required for paging')
+    return page, limit
+
+
+def feed_filters(request):
+    """The `(parameter, value)` filters asked for on a global feed,
+    see `FEED_FILTERS`. A parameter can be given more than once, an
+    item has to match all of its values.
+    """
+    filters = []
+    for param in sorted(FEED_FILTERS):
+        for value in request.params.getall(param):
+            filters.append((param, value))
+    return filters
+
+
+def paging_links(request, route_name, page, limit, total, filters=()):
+    """Build the RFC 5005 paging links for a page of a feed, keeping
+    its `filters`.
+    """
+    last = max(1, (total + limit - 1) // limit)
+
+    def page_url(number):
+        query = list(filters) + [('page', number), ('limit', limit)]
+        return route_url(route_name, request, _query=query)
+
+    links = [('first', page_url(1))]
+    if page > 1:
+        links.append(('previous', page_url(min(page - 1, last))))
+    if page < last:
+        links.append(('next', page_url(page + 1)))
+    links.append(('last', page_url(last)))
+    return links
+
+
+def feed_cache(registry):
+    """The cache of rendered global feeds, sized by
+    `push.feed_cache_size` (0 turns it off).
+    """
+    cache = getattr(registry, 'feed_cache', None)
+    if cache is None:
+        size = int(registry.settings.get('push.feed_cache_size', 32))
+        cache = registry.feed_cache = LRUCache(size)
+    return cache
+
+
+def search_cache(registry):
+    """The cache of search results, sized by `push.search_cache_size`
+    (0 turns it off) and kept for `push.search_cache_ttl` seconds.
+    """
+    cache = getattr(registry, 'search_cache', None)
+    if cache is None:
+        settings = registry.settings
+        cache = registry.search_cache = SearchCache(
+            size=int(settings.get('push.search_cache_size', 128)),
+            ttl=float(settings.get('push.search_cache_ttl', 60)),
         )
-    return new_feed.writeString('utf-8')
+    return cache
+
+
+def not_modified(request, etag, last_modified):
+    """Check the conditional headers of the request
+    """
+    if request.if_none_match:
+        return etag in request.if_none_match
+    if last_modified is not None and request.if_modified_since:
+        return last_modified.replace(microsecond=0) <= \
+            request.if_modified_since
+    return False
+
+
+def global_feed(context, request, feed_name, title, description):
+    """Render one of the global feeds, a page at a time if asked to.
+    The feeds are served from the route named after them.
+
+    Rendered feeds without filters are cached until the pool changes,
+    and clients that already have the current version get a 304.
+    """
+    try:
+        page, limit = feed_paging(request)
+    except ValueError as e:
+        return HTTPBadRequest(body=str(e))
+    filters = feed_filters(request)
+    sequence = context.sequence
+    etag = '%s-%s' % (feed_name, sequence)
+    if not_modified(request, etag, context.last_modified):
+        response = HTTPNotModified()
+    else:
+        cache = feed_cache(request.registry)
+        # The feed links are absolute, so they depend on the host
+        cache_key = (request.application_url, feed_name, page, limit)
+        # Filtered feeds would let any query string push the common
+        # pages out of the cache, and feeds put together from a pool
+        # that isn't indexed yet are not kept either, see
+        # `SharedItems.needs_reindex`
+        shared = context.shared
+        cacheable = not filters and not (
+            isinstance(shared, SharedItems) and shared.needs_reindex())
+        cached = cache.get(cache_key)
+        if cacheable and cached is not None and cached[0] == sequence:
+            response = Response(cached[1])
+        else:
+            body_file, size = spool_feed(render_global_feed(
+                context, request, feed_name, title, description,
+                page, limit, filters))
+            max_cached = int(request.registry.settings.get(
+                'push.feed_cache_max_size', 1024 * 1024))
+            if cacheable and size <= max_cached:
+                body = body_file.read()
+                body_file.close()
+                cache.set(cache_key, (sequence, body))
+                response = Response(body)
+            else:
+                response = Response(
+                    app_iter=FileIter(body_file),
+                    content_length=size,
+                )
+    response.etag = etag
+    if context.last_modified is not None:
+        response.last_modified = context.last_modified
+    return response
+
+
+def render_global_feed(context, request, feed_name, title, description,
+                       page, limit, filters=()):
+    """Stream a global feed, or a page of it, with only the items
+    matching the `filters`, see `feed_filters`.
+
+    The entries of a `SharedItems` folder are kept serialized, so
+    they are copied into the feed without waking up the items.
+    """
+    shared = context.shared
+    links = None
+    updated = None
+    if isinstance(shared, SharedItems):
+        keys = shared.feed_keys(
+            feed_name, [(FEED_FILTERS[param], value)
+                        for param, value in filters])
+        if limit is not None:
+            start = (page - 1) * limit
+            links = paging_links(request, feed_name, page, limit,
+                                 len(keys), filters)
+            keys = keys[start:start + limit]
+        entries = shared.fragments_of(keys)
+        for first in shared.items_of(keys[:1]):
+            updated = first.Modified
+    elif limit is None:
+        entries = combine_entries(shared, feed_name)
+    else:
+        start = (page - 1) * limit
+        entries = combine_entries(shared, feed_name, start + limit)[start:]
+    return stream_feed(
+        entries,
+        title,
+        route_url(feed_name, request, _query=list(filters)),
+        description,
+        paging_links=links,
+        updated=updated,
+    )
 
 
 def global_shared(context, request):
-    entries = combine_entries(context.shared, 'shared')
-    return Response(create_feed(entries,
-                       'All Shared Entries',
-                       route_url('shared', request),
-                       'A combined feed of all entries shared to the PuSH Hub.'
-    ))
+    return global_feed(context, request, 'shared', *GLOBAL_FEEDS['shared'])
 
 
 def global_selected(context, request):
-    entries = combine_entries(context.shared, 'selected')
-    return Response(create_feed(entries,
-                       'All Selected Entries',
-                       route_url('selected', request),
-                       'A combined feed of all entries selected across '
-                       'the PuSH Hub.'
-    ))
+    return global_feed(context, request, 'selected',
+                       *GLOBAL_FEEDS['selected'])
 
 
 def global_deleted(context, request):
-    entries = combine_entries(context.shared, 'deleted')
-    return Response(create_feed(entries,
-                       'All Deleted Entries',
-                       route_url('deleted', request),
-                       'A combined feed of all entries that were deleted '
-                       ' across the PuSH Hub.'
+    return global_feed(context, request, 'deleted', *GLOBAL_FEEDS['deleted'])
+
+
+def tile_feed(context, request):
+    """A feed of the items placed on the tile given as `url`, newest
+    first, or of the items removed from it when `removed` is true.
+    """
+    tile_url = request.params.get('url')
+    if not tile_url:
+        return HTTPBadRequest(body='The url of a tile is required')
+    removed = asbool(request.params.get('removed', False))
+    etag = 'tile-%s' % context.sequence
+    if not_modified(request, etag, context.last_modified):
+        response = HTTPNotModified()
+        response.etag = etag
+        return response
+    shared = context.shared
+    name = 'deleted_tile' if removed else 'tile'
+    updated = None
+    for first in shared.indexed_items(name, tile_url, 0, 1):
+        updated = first.Modified
+    query = {'url': tile_url}
+    if removed:
+        query['removed'] = 'true'
+        title = 'Entries Removed From %s' % tile_url
+        description = 'The entries removed from the tile %s.' % tile_url
+    else:
+        title = 'Entries On %s' % tile_url
+        description = 'The entries placed on the tile %s.' % tile_url
+    response = Response(create_feed(
+        shared.indexed_fragments(name, tile_url),
+        title,
+        route_url('tile', request, _query=query),
+        description,
+        updated=updated,
+    ))
+    response.etag = etag
+    if context.last_modified is not None:
+        response.last_modified = context.last_modified
+    return response
+
+
+def search(context, request):
+    """Search the shared items in Solr, see `pushhubsearch.search` for
+    the syntax of the `q` parameter. The items found are returned as
+    an Atom feed, best matches first.
+
+    The uids found are cached until Solr is written to, so repeated
+    searches don't reach Solr.
+    """
+    text = request.params.get('q', u'')
+    try:
+        query = Search.parse(text)
+        rows = feed_limit(request) or SEARCH_ROWS
+    except ValueError as e:
+        return HTTPBadRequest(body=str(e))
+    cache = search_cache(request.registry)
+    cache_key = (query.key(), rows)
+    uids = cache.get(cache_key)
+    if uids is None:
+        generation = solr_generation.value
+        params = query.solr_params(
+            rows, request.registry.settings.get('push.search_fields'))
+        response = get_solr(request.registry).search(**params)
+        if getattr(response, 'status', 200) != 200:
+            logger.error('Solr search failed: %s' % params)
+            return HTTPBadGateway(body='The search failed')
+        uids = [document['uid'] for document in response.documents]
+        cache.set(cache_key, uids, generation)
+    shared = context.shared
+    # Solr may still have items that were just deleted
+    found = [uid for uid in uids if uid in shared]
+    updated = None
+    if found:
+        updated = shared[found[0]].Modified
+    return Response(create_feed(
+        [shared.fragment(uid) or shared[uid] for uid in found],
+        'Search Results',
+        route_url('search', request, _query={'q': text}),
+        'The entries matching the search "%s".' % text,
+        updated=updated,
     ))
+
+
+def changes_feed(context, request):
+    """A feed of the items created, updated or deleted after the
+    change sequence number given as `since`, oldest change first.
+
+    Deleted items are listed as RFC 6721 tombstones. The feed tells
+    the last sequence number it includes, and links to the next
+    batch of changes when it was cut short by the `limit`.
+    """
+    try:
+        since = int(request.params.get('since', 0))
+        limit = feed_limit(request)
+    except ValueError as e:
+        return HTTPBadRequest(body=str(e))
+    etag = 'changes-%s-%s' % (since, context.sequence)
+    if not_modified(request, etag, context.last_modified):
+        response = HTTPNotModified()
+        response.etag = etag
+        return response
+    changes = context.shared.changes(since)
+    if limit is not None:
+        changes = list(islice(changes, limit + 1))
+    entries = []
+    tombstones = []
+    last = since
+    links = None
+    updated = None
+    for sequence, uid, item, deleted in changes:
+        if limit is not None and len(entries) + len(tombstones) == limit:
+            query = {'since': last, 'limit': limit}
+            links = [('next', route_url('changes', request, _query=query))]
+            break
+        last = sequence
+        if item is None:
+            tombstones.append(('urn:syndication:%s' % uid, deleted))
+        else:
+            if not entries:
+                updated = item.Modified
+            entries.append(context.shared.fragment(uid) or item)
+    new_feed = Atom1Feed(
+        title='Changed Entries',
+        link=route_url('changes', request),
+        description='The entries changed across the PuSH Hub since '
+                    'change %s.' % since,
+        paging_links=links,
+        sequence=last,
+        updated=updated,
+    )
+    chunks = new_feed.stream(
+        feed_chunks(entries),
+        tombstones=tombstones,
+    )
+    body_file, size = spool_feed(chunks)
+    response = Response(app_iter=FileIter(body_file), content_length=size)
+    response.etag = etag
+    if context.last_modified is not None:
+        response.last_modified = context.last_modified
+    return response
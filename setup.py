@@ -46,6 +46,7 @@ install_requires = [
     'pyramid_zodbconn',
     'python-dateutil',
     'repoze.folder',
+    'requests',
     'waitress',
     'ZODB3',
 ]
@@ -80,5 +81,8 @@ setup(
     entry_points="""
         [paste.app_factory]
         main = pushhubsearch:main
+        [console_scripts]
+        pushhubsearch_evolve = pushhubsearch.evolve:main
+        pushhubsearch_snapshot = pushhubsearch.snapshot:main
     """,
 )